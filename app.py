@@ -1,15 +1,58 @@
-from flask import Flask, jsonify, request
-from urllib.parse import unquote
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
 import os
 import sqlite3
-import json
 import logging
-
-logging.basicConfig(level=logging.DEBUG)
+from functools import partial
+
+import metrics
+from cache import cached_response, response_cache
+from db import PoolTimeout, get_connection, pool_stats
+from facets import facet_index
+from geo import DEFAULT_RADIUS_M, KNN_MAX_RADIUS_M, nearby_restaurants
+from metrics import add_rows, timed
+from payloads import (
+    DETAIL_KEYS,
+    JSON_MIMETYPE,
+    build_detail,
+    build_menu,
+    fetch_detail_rows,
+    get_payload,
+)
+from search import (
+    MAX_PAGE_SIZE,
+    SORT_ORDERS,
+    STREAM_CHUNK_SIZE,
+    has_table,
+    iter_restaurants,
+    parse_fields,
+    parse_list_options,
+    parse_restaurants_filters,
+    parse_results_filters,
+    search_restaurants,
+)
+
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper())
 
 app = Flask(__name__)
+# 日本語をエスケープせず UTF-8 のまま返す（事前生成した payloads.dumps と同じ形式）
+app.json.ensure_ascii = False
+app.json.mimetype = JSON_MIMETYPE
 CORS(app, resources={r"/*": {"origins": "*"}})  # 全エンドポイントでCORSを許可
+metrics.init_app(app)  # リクエストごとの処理時間を計測し Server-Timing ヘッダーを付与
+
+# /api/favorites で返す列と既定の件数
+FAVORITE_FIELDS = [
+    'id', 'name', 'category', 'area', 'tabelog_rating', 'google_rating',
+    'budget_min', 'budget_max', 'store_top_image',
+]
+FAVORITES_LIMIT = 5
+
+@app.errorhandler(PoolTimeout)
+def handle_pool_timeout(e):
+    # 接続の空き待ちがタイムアウトした場合は、混雑として 503 を返す
+    logging.warning("データベース接続の確保がタイムアウトしました: %s", e)
+    return jsonify({'error': 'サーバーが混み合っています。しばらくしてから再度お試しください。'}), 503, {'Retry-After': '1'}
 
 @app.route('/api/hello', methods=['GET'])
 def hello_world():
@@ -18,65 +61,294 @@ def hello_world():
 @app.route('/api/check-db', methods=['GET'])
 def check_db():
     try:
-        conn = sqlite3.connect('example.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM restaurants LIMIT 5")
-        rows = cursor.fetchall()
-        conn.close()
+        with get_connection() as conn:
+            cursor = conn.execute("SELECT * FROM restaurants LIMIT 5")
+            rows = cursor.fetchall()
         return jsonify(rows)
     except sqlite3.Error as e:
         logging.error(f"Error reading database: {e}")
         return jsonify({"error": "データベースエラーが発生しました。"}), 500
 
+@app.route('/api/pool-stats', methods=['GET'])
+def get_pool_stats():
+    # コネクションプールの利用状況を返す（運用監視用）
+    return jsonify(pool_stats())
+
+@app.route('/api/cache-stats', methods=['GET'])
+def get_cache_stats():
+    # レスポンスキャッシュのヒット・ミス数を返す（運用監視用）
+    return jsonify(response_cache.stats())
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    # Prometheus のテキスト形式でレイテンシ・件数・キャッシュ・プールの指標を返す
+    cache = response_cache.stats()
+    pools = pool_stats()
+    gauges = [
+        ('response_cache_events', 'Response cache counters.',
+         [({'event': event}, cache[event])
+          for event in ('hits', 'misses', 'evictions', 'expirations', 'invalidations')]),
+        ('response_cache_entries', 'Entries held in the response cache.', [({}, cache['size'])]),
+        ('response_cache_bytes', 'Bytes held in the response cache.', [({}, cache['bytes'])]),
+        ('db_pool_connections', 'Database pool connections by state.',
+         [({'pool': name, 'state': state}, stats[state])
+          for name, stats in pools.items() for state in ('created', 'idle', 'in_use')]),
+        ('db_pool_timeouts', 'Connection waits that timed out.',
+         [({'pool': name}, stats['timeouts']) for name, stats in pools.items()]),
+    ]
+    return Response(metrics.registry.render(gauges), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/restaurants', methods=['GET', 'POST'])
 def get_restaurants():
     if request.method == 'POST':
-        filters = request.json  # POSTリクエストのボディを取得
-        area = filters.get('area', '')
-        genre = filters.get('genre', '')
-        people = filters.get('people', 0)
-
-        # データベースクエリに基づいてフィルタリング
-        query = 'SELECT * FROM restaurants WHERE 1=1'
-        params = []
-
-        if area:
-            query += ' AND area = ?'
-            params.append(area)
-        if genre:
-            query += ' AND category LIKE ?'
-            params.append(f'%{genre}%')
-        if people:
-            query += ' AND capacity >= ?'
-            params.append(people)
-
-        conn = sqlite3.connect('example.db')
-        c = conn.cursor()
-        c.execute(query, params)
-        rows = c.fetchall()
-        conn.close()
+        with timed('parse'):
+            filters = request.json  # POSTリクエストのボディを取得
+            filters = parse_restaurants_filters(filters)
 
-        # レスポンス用にデータを整形
-        column_names = [desc[0] for desc in c.description]
-        restaurants = [dict(zip(column_names, row)) for row in rows]
-        return jsonify({'restaurants': restaurants})
+        # データベースクエリに基づいてフィルタリング（同じ条件の結果はキャッシュから返す）
+        return _list_response('restaurants', filters)
 
     # GETメソッド用の処理
-    conn = sqlite3.connect('example.db')
-    c = conn.cursor()
-    c.execute('SELECT * FROM restaurants')
-    rows = c.fetchall()
-    conn.close()
+    return _list_response('restaurants', {})
+
+def _list_response(namespace, filters):
+    # ?limit=&cursor= でキーセットページング、?fields= で列の射影、
+    # ?format=ndjson または ?stream=1 でカーソルから逐次書き出すストリーミング応答
+    # ?sort=（score / tabelog_rating / google_rating / budget / distance）&limit= で上位 k 件
+    try:
+        with timed('parse'):
+            options = parse_list_options(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if options['stream']:
+        return _stream_response(filters, options)
+
+    if options['sort'] == 'distance':
+        return cached_response(namespace, {'filters': filters, 'options': options},
+                               lambda: _distance_response(filters, options))
+
+    def build():
+        limit = options['limit']
+        sort = options['sort']
+        if sort is not None:
+            # 並び替えの場合はカーソルを返さないので、上位 limit 件だけを取り出す
+            column_names, rows = search_restaurants(
+                filters, options['fields'], limit=limit, sort=sort
+            )
+        else:
+            column_names, rows = search_restaurants(
+                filters, options['fields'], options['after'], limit + 1 if limit else None
+            )
 
-    column_names = [desc[0] for desc in c.description]
-    restaurants = [dict(zip(column_names, row)) for row in rows]
-    return jsonify({'restaurants': restaurants})
+        # レスポンス用にデータを整形
+        with timed('serialize'):
+            payload = {}
+            if limit and sort is None:
+                # 1件多く取得して次のページの有無を判定する
+                has_more = len(rows) > limit
+                rows = rows[:limit]
+                payload['next_cursor'] = rows[-1][column_names.index('id')] if has_more else None
+            payload['restaurants'] = [dict(zip(column_names, row)) for row in rows]
+            response = jsonify(payload)
+        add_rows(len(rows))
+        return response, 200
+
+    return cached_response(namespace, {'filters': filters, 'options': options}, build)
+
+def _distance_response(filters, options):
+    # 近隣検索（R*Tree）で近い順に上位 limit 件を返す（limit 省略時は MAX_PAGE_SIZE 件、最大 KNN_MAX_RADIUS_M まで）
+    lat, lng = options['origin']
+    column_names, results = nearby_restaurants(
+        filters, lat, lng, k=options['limit'] or MAX_PAGE_SIZE, fields=options['fields']
+    )
+    with timed('serialize'):
+        restaurants = _distance_items(column_names, results)
+        response = jsonify({'restaurants': restaurants})
+    add_rows(len(restaurants))
+    return response, 200
+
+def _distance_items(column_names, results):
+    restaurants = []
+    for distance, row in results:
+        restaurant = dict(zip(column_names, row))
+        restaurant['distance'] = round(distance, 1)
+        restaurants.append(restaurant)
+    return restaurants
+
+def _stream_response(filters, options):
+    limit = options['limit']
+    ndjson = options['format'] == 'ndjson'
+    sort = options['sort']
+    # 並び替えの場合はカーソルを返さないので、上位 limit 件だけを読み出す
+    paged = limit and not ndjson and sort is None
+    column_names, rows = iter_restaurants(
+        filters, options['fields'], options['after'],
+        limit + 1 if paged else limit, sort=sort,
+    )
+    dumps = partial(app.json.dumps, separators=(',', ':'))
+    id_index = column_names.index('id')
+
+    def generate():
+        if not ndjson:
+            yield '{"restaurants":['
+        chunk = []
+        written = 0
+        last_id = None
+        has_more = False
+        for row in rows:
+            if written == limit:
+                has_more = True
+                break
+            item = dumps(dict(zip(column_names, row)))
+            chunk.append(item + '\n' if ndjson else (',' if written else '') + item)
+            written += 1
+            last_id = row[id_index]
+            if len(chunk) >= STREAM_CHUNK_SIZE:
+                yield ''.join(chunk)
+                chunk = []
+        if chunk:
+            yield ''.join(chunk)
+        add_rows(written)
+        if not ndjson:
+            tail = ']'
+            if paged:
+                tail += ',"next_cursor":' + dumps(last_id if has_more else None)
+            yield tail + '}'
+
+    content_type = 'application/x-ndjson; charset=utf-8' if ndjson else JSON_MIMETYPE
+    return Response(stream_with_context(generate()), content_type=content_type)
+
+@app.route('/api/restaurants/nearby', methods=['GET'])
+def get_nearby_restaurants():
+    # ?lat=&lng= を中心に ?radius=（メートル）または ?k=（件数）で近隣の店舗を距離順に返す
+    # k を省略した場合は半径内（既定 DEFAULT_RADIUS_M）の近い順に最大 MAX_PAGE_SIZE 件を返し、
+    # それより多く一致した場合は truncated を true にする
+    # area, genre, guests, budgetMin, budgetMax, privateRoom, drinkIncluded で絞り込み可能
+    # ?fields= で返す列を指定できる（/results と同じ）
+    try:
+        lat = float(request.args['lat'])
+        lng = float(request.args['lng'])
+        radius = float(request.args['radius']) if request.args.get('radius') else None
+        k = int(request.args['k']) if request.args.get('k') else None
+    except (KeyError, ValueError):
+        return jsonify({'error': 'lat と lng（数値）は必須です。radius は数値、k は整数で指定してください。'}), 400
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return jsonify({'error': 'lat/lng が範囲外です。'}), 400
+    if radius is not None and not 0 < radius <= KNN_MAX_RADIUS_M:
+        return jsonify({'error': f'radius は 0〜{KNN_MAX_RADIUS_M} メートルで指定してください。'}), 400
+    if k is not None and not 0 < k <= MAX_PAGE_SIZE:
+        return jsonify({'error': f'k は 1〜{MAX_PAGE_SIZE} で指定してください。'}), 400
+
+    with timed('parse'):
+        filters = parse_results_filters(request.args.to_dict())
+        try:
+            fields = parse_fields(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+    def build():
+        if k is None:
+            # 件数の指定が無い場合も全件は読まず、1件多く探して打ち切りの有無を判定する
+            column_names, results = nearby_restaurants(
+                filters, lat, lng, radius or DEFAULT_RADIUS_M, MAX_PAGE_SIZE + 1, fields
+            )
+        else:
+            column_names, results = nearby_restaurants(filters, lat, lng, radius, k, fields)
+        truncated = len(results) > MAX_PAGE_SIZE
+        results = results[:MAX_PAGE_SIZE]
+        with timed('serialize'):
+            body = {'restaurants': _distance_items(column_names, results)}
+            if k is None:
+                body['truncated'] = truncated
+            response = jsonify(body)
+        add_rows(len(results))
+        return response, 200
+
+    key = {'filters': filters, 'lat': lat, 'lng': lng, 'radius': radius, 'k': k, 'fields': fields}
+    return cached_response('nearby', key, build)
+
+@app.route('/api/restaurants/batch', methods=['POST'])
+def get_restaurants_batch():
+    # {"ids": [...], "fields": [...], "menus": true} で複数店舗の詳細をまとめて返す
+    # 結果はリクエストの順番通りで、存在しない id には error を付けて返す
+    with timed('parse'):
+        body = request.get_json(silent=True)
+        # オブジェクト以外の JSON（配列など）は ids が無いものとして扱う
+        if not isinstance(body, dict):
+            body = {}
+        ids = body.get('ids')
+        fields = body.get('fields')
+        menus = body.get('menus', False)
+    if not isinstance(ids, list) or not all(type(id) is int for id in ids):
+        return jsonify({'error': 'ids には整数の配列を指定してください。'}), 400
+    if len(ids) > MAX_PAGE_SIZE:
+        return jsonify({'error': f'ids は {MAX_PAGE_SIZE} 件以内で指定してください。'}), 400
+    if fields is not None:
+        if not isinstance(fields, list) or not all(isinstance(name, str) for name in fields):
+            return jsonify({'error': 'fields には文字列の配列を指定してください。'}), 400
+        unknown = [name for name in fields if name not in DETAIL_KEYS]
+        if unknown:
+            return jsonify({'error': f"unknown fields: {', '.join(unknown)}"}), 400
+    if not isinstance(menus, bool):
+        return jsonify({'error': 'menus には true または false を指定してください。'}), 400
+
+    def build():
+        with timed('query'), get_connection() as conn:
+            rows = fetch_detail_rows(conn, ids)
+
+        with timed('serialize'):
+            restaurants = []
+            for id in ids:
+                row = rows.get(id)
+                if row is None:
+                    restaurants.append({'id': id, 'error': 'Restaurant not found'})
+                    continue
+                restaurant = build_detail(row)
+                if fields is not None:
+                    restaurant = {name: restaurant[name] for name in ['id'] + fields}
+                if menus:
+                    try:
+                        restaurant['menu_details'] = build_menu(row)
+                    except (TypeError, ValueError, AttributeError):
+                        # 解釈できないメニューは null とし、他の店舗の結果は返す
+                        restaurant['menu_details'] = None
+                restaurants.append(restaurant)
+            response = jsonify({'restaurants': restaurants})
+        add_rows(len(rows))
+        return response, 200
+
+    key = {'ids': ids, 'fields': fields, 'menus': menus}
+    return cached_response('batch', key, build)
+
+@app.route('/api/facets', methods=['GET', 'POST'])
+def get_facets():
+    # 現在の絞り込み条件に対する、エリア・ジャンル・予算帯・個室・飲み放題ごとの件数を返す
+    # 条件は /results と同じ形式（POST の JSON ボディ、または GET のクエリパラメータ）
+    with timed('parse'):
+        if request.method == 'POST':
+            payload = request.get_json(silent=True) or {}
+        else:
+            payload = request.args.to_dict()
+        try:
+            filters = parse_results_filters(payload)
+        except AttributeError:
+            return jsonify({'error': 'フィルタの値が不正です。'}), 400
+
+    def build():
+        try:
+            with timed('query'):
+                counts = facet_index.counts(filters)
+        except TypeError:
+            return jsonify({'error': 'フィルタの値が不正です。'}), 400
+        with timed('serialize'):
+            return jsonify(counts), 200
 
-@app.before_request
-def log_request_info():
-    logging.debug("Request Headers: %s", request.headers)
-    logging.debug("Request Body: %s", request.get_data(as_text=True))
+    return cached_response('facets', filters, build)
 
+@app.route('/api/facet-stats', methods=['GET'])
+def get_facet_stats():
+    return jsonify(facet_index.stats())
 
 @app.route('/results', methods=['POST'])
 def get_results():
@@ -86,147 +358,58 @@ def get_results():
             return jsonify({'error': '405 Method Not Allowed'}), 405
 
         # クエリパラメータの取得とデコード
-        filters = request.json
-        logging.debug(f"受信したフィルタ: {filters}")
-
-        area = unquote(filters.get('area', '').strip()) or None
-        genre = unquote(filters.get('genre', '').strip()) or None
-        guests = filters.get('guests', 0)
-        budget_min = filters.get('budgetMin', None)
-        budget_max = filters.get('budgetMax', None)
-        private_room = unquote(filters.get('privateRoom', '').strip()) or None
-        drink_included = unquote(filters.get('drinkIncluded', '').strip()) or None
-
-        logging.debug(f"デコード後のフィルタ: area={area}, genre={genre}, guests={guests}, "
-                      f"budget_min={budget_min}, budget_max={budget_max}, "
-                      f"private_room={private_room}, drink_included={drink_included}")
-
-        # SQLクエリの構築
-        query = 'SELECT * FROM restaurants WHERE 1=1'
-        params = []
-
-        if area:
-            query += ' AND area = ?'
-            params.append(area)
-        if genre:
-            query += ' AND category LIKE ?'
-            params.append(f"%{genre}%")
-        if guests:
-            query += ' AND capacity >= ?'
-            params.append(guests)
-        if budget_min:
-            query += ' AND budget_min >= ?'
-            params.append(budget_min)
-        if budget_max:
-            query += ' AND budget_max <= ?'
-            params.append(budget_max)
-        if private_room in ['有', '無']:
-            query += ' AND has_private_room = ?'
-            params.append(private_room)
-        if drink_included in ['有', '無']:
-            query += ' AND has_drink_all_included = ?'
-            params.append(drink_included)
-
-        logging.debug(f"実行クエリ: {query} パラメータ: {params}")
-
-        # データベースクエリ実行
-        conn = sqlite3.connect('example.db')
-        cursor = conn.cursor()
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
-        column_names = [desc[0] for desc in cursor.description]
-        conn.close()
-
-        # 結果整形
-        restaurants = [dict(zip(column_names, row)) for row in rows]
-        logging.debug(f"取得したデータ: {restaurants}")
-
-        return jsonify({'restaurants': restaurants}), 200
+        with timed('parse'):
+            filters = request.json
+            logging.debug("受信したフィルタ: %s", filters)
 
+            filters = parse_results_filters(filters)
+            logging.debug("デコード後のフィルタ: %s", filters)
+
+        # データベースクエリ実行（SEARCH_ENGINE=columnar の場合はメモリ内検索）
+        return _list_response('results', filters)
+
+    except PoolTimeout:
+        raise
     except Exception as e:
         logging.error(f"エラー発生: {str(e)}")
         return jsonify({'error': 'サーバー内部エラー', 'details': str(e)}), 500
 
 @app.route('/restaurant/<int:id>', methods=['GET'])
 def get_restaurant_by_id(id):
-    conn = sqlite3.connect('example.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM restaurants WHERE id = ?", (id,))
-    row = cursor.fetchone()
-    conn.close()
-
-    if row is None:
-        print("No data found for this ID")
+    return cached_response('restaurant', id, lambda: _restaurant_response(id))
+
+def _restaurant_response(id):
+    # 事前生成済みの JSON バイト列をそのまま返す（無い場合はその場で生成）
+    with timed('query'), get_connection() as conn:
+        body = get_payload(conn, id, 'detail', has_table(conn, 'restaurant_payloads'))
+
+    if body is None:
+        logging.info("No data found for this ID: %s", id)
         return jsonify({'error': 'Restaurant not found'}), 404
 
-    restaurant = {
-        "id": row[0],
-        "name": row[1],
-        "address": row[2],
-        "phone_number": row[3],
-        "tabelog_rating": row[4],
-        "tabelog_review_count": row[5],
-        "tabelog_link": row[6],
-        "google_rating": row[7],
-        "google_review_count": row[8],
-        "google_link": row[9],
-        "opening_hours": row[10],
-        "course": row[11],
-        "menu": row[12],
-        "drink_menu": row[13],
-        "store_top_image": row[14],
-        "description": row[15],
-        "longitude": row[16],
-        "latitude": row[17],
-        "area": row[18],
-        "nearest_station": row[19],
-        "directions": row[20],
-        "capacity": row[21],
-        "category": row[22],
-        "budget_min": row[23],
-        "budget_max": row[24],
-        "has_private_room": row[25],
-        "has_drink_all_included": row[26],
-        "detail_image1": row[27],
-        "detail_image2": row[28],
-        "detail_image3": row[29],
-    }
-    return jsonify(restaurant)
+    add_rows(1)
+    return Response(body, content_type=JSON_MIMETYPE)
 
 @app.route('/restaurant/<int:id>/menu', methods=['GET'])
 def get_menu_details(id):
-    try:
-        # データベース接続
-        conn = sqlite3.connect('example.db')
-        cursor = conn.cursor()
+    return cached_response('menu', id, lambda: _menu_response(id))
 
-        # メニューとドリンクメニューを取得
-        cursor.execute("SELECT menu, drink_menu FROM restaurants WHERE id = ?", (id,))
-        row = cursor.fetchone()
-        conn.close()
+def _menu_response(id):
+    try:
+        # メニューとドリンクメニューを取得（書き込み時に正規化・シリアライズ済み）
+        with timed('query'), get_connection() as conn:
+            body = get_payload(conn, id, 'menu', has_table(conn, 'restaurant_payloads'))
 
         # データが見つからない場合
-        if not row:
+        if body is None:
             return jsonify({"error": "Menu not found"}), 404
 
-        # データ形式の処理
-        food_menu = row[0]
-        drink_menu = row[1]
-
-        # JSON文字列で保存されている場合
-        try:
-            food_menu = json.loads(food_menu) if food_menu else []
-            drink_menu = json.loads(drink_menu) if drink_menu else []
-        except json.JSONDecodeError:
-            # カンマ区切りの場合
-            food_menu = food_menu.split(",") if food_menu else []
-            drink_menu = drink_menu.split(",") if drink_menu else []
-
         # メニューを返却
-        return jsonify({
-            "foodMenu": food_menu,
-            "drinkMenu": drink_menu,
-        }), 200
+        add_rows(1)
+        return Response(body, status=200, content_type=JSON_MIMETYPE)
+
+    except PoolTimeout:
+        raise
 
     except sqlite3.Error as e:
         # データベースエラー時の処理
@@ -238,25 +421,39 @@ def get_menu_details(id):
 
 @app.route('/api/favorites', methods=['GET'])
 def get_favorites():
+    # ?sort=score などを指定した場合は並び替えの上位 ?limit= 件（既定 5 件）を返す
+    sort = request.args.get('sort') or None
     try:
-        # データベース接続
-        conn = sqlite3.connect('example.db')
-        cursor = conn.cursor()
-
-        # 上から5番目のデータを取得
-        cursor.execute("""
-            SELECT id, name, category, area, tabelog_rating, google_rating, 
-                   budget_min, budget_max, store_top_image
-            FROM restaurants
-            LIMIT 5 OFFSET 4
-        """)
-        rows = cursor.fetchall()
-        column_names = [desc[0] for desc in cursor.description]
-        conn.close()
+        limit = int(request.args.get('limit', FAVORITES_LIMIT))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    if sort is not None and sort not in SORT_ORDERS:
+        return jsonify({'error': f"sort must be one of: {', '.join(SORT_ORDERS)}"}), 400
+    if not 0 < limit <= MAX_PAGE_SIZE:
+        return jsonify({'error': f'limit must be between 1 and {MAX_PAGE_SIZE}'}), 400
+
+    try:
+        if sort is not None:
+            column_names, rows = search_restaurants({}, FAVORITE_FIELDS, limit=limit, sort=sort)
+        else:
+            # 上から5番目のデータを取得
+            with timed('query'), get_connection() as conn:
+                cursor = conn.execute(f"""
+                    SELECT {', '.join(FAVORITE_FIELDS)}
+                    FROM restaurants
+                    LIMIT ? OFFSET 4
+                """, (limit,))
+                rows = cursor.fetchall()
+                column_names = [desc[0] for desc in cursor.description]
 
         # データ整形
-        favorites = [dict(zip(column_names, row)) for row in rows]
-        return jsonify({"favorites": favorites}), 200
+        add_rows(len(rows))
+        with timed('serialize'):
+            favorites = [dict(zip(column_names, row)) for row in rows]
+            return jsonify({"favorites": favorites}), 200
+
+    except PoolTimeout:
+        raise
 
     except sqlite3.Error as e:
         return jsonify({"error": "Database error", "details": str(e)}), 500
@@ -0,0 +1,333 @@
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError:  # Windows では最大 RSS を取得しない
+    resource = None
+
+# 回帰とみなす悪化率の既定値と、誤差として無視するレイテンシ差（ミリ秒）・メモリ差（バイト）
+DEFAULT_THRESHOLD = 0.2
+DEFAULT_MIN_DELTA_MS = 0.5
+MIN_DELTA_BYTES = 256 * 1024
+# メモリ計測（tracemalloc）は遅いので、この件数だけ別に実行して測る
+MEMORY_SAMPLE_REQUESTS = 20
+
+# 比較する指標と、値が大きくなると悪化か（True）小さくなると悪化か（False）
+COMPARED_METRICS = (
+    ('p50_ms', True),
+    ('p95_ms', True),
+    ('p99_ms', True),
+    ('throughput_rps', False),
+    ('peak_memory_bytes', True),
+)
+
+
+class Dataset:
+    """リクエストのパラメータに使う値をデータベースから集めたもの。"""
+
+    def __init__(self, path):
+        conn = sqlite3.connect(path)
+        try:
+            self.rows, self.max_id = conn.execute('SELECT COUNT(*), MAX(id) FROM restaurants').fetchone()
+            self.areas = [row[0] for row in conn.execute(
+                'SELECT DISTINCT area FROM restaurants WHERE area IS NOT NULL')]
+            genres = set()
+            for (category,) in conn.execute(
+                    'SELECT DISTINCT category FROM restaurants WHERE category IS NOT NULL'):
+                genres.update(genre for genre in category.split('・') if genre)
+            self.genres = sorted(genres)
+            self.points = conn.execute(
+                'SELECT latitude, longitude FROM restaurants'
+                ' WHERE latitude IS NOT NULL AND longitude IS NOT NULL LIMIT 1000').fetchall()
+        finally:
+            conn.close()
+        if not self.rows:
+            raise SystemExit('restaurants テーブルにデータがありません（generate_dataset.py で作成してください）')
+
+    def id(self, rng):
+        return rng.randint(1, self.max_id)
+
+    def area(self, rng):
+        return rng.choice(self.areas) if self.areas else ''
+
+    def genre(self, rng):
+        return rng.choice(self.genres) if self.genres else ''
+
+
+# シナリオ名 -> (エンドポイント, 条件の形, リクエストを作る関数)
+# 関数は (メソッド, パス, JSON ボディ) を返す
+SCENARIOS = {
+    'results_page': ('/results', 'no filter, limit=100',
+                     lambda d, r: ('POST', '/results?limit=100', {})),
+    'results_area': ('/results', 'area',
+                     lambda d, r: ('POST', '/results', {'area': d.area(r)})),
+    'results_genre': ('/results', 'genre',
+                      lambda d, r: ('POST', '/results', {'genre': d.genre(r)})),
+    'results_area_genre': ('/results', 'area + genre',
+                           lambda d, r: ('POST', '/results', {'area': d.area(r), 'genre': d.genre(r)})),
+    'results_area_guests_budget': ('/results', 'area + guests + budget range',
+                                   lambda d, r: ('POST', '/results', {
+                                       'area': d.area(r), 'guests': r.choice((10, 20, 40)),
+                                       'budgetMin': r.choice((2000, 3000)), 'budgetMax': r.choice((6000, 8000)),
+                                   })),
+    'results_flags': ('/results', 'privateRoom + drinkIncluded + guests',
+                      lambda d, r: ('POST', '/results', {
+                          'privateRoom': '有', 'drinkIncluded': r.choice(('有', '無')), 'guests': 30,
+                      })),
+    'results_all_filters': ('/results', 'all filters',
+                            lambda d, r: ('POST', '/results', {
+                                'area': d.area(r), 'genre': d.genre(r), 'guests': 10,
+                                'budgetMin': 2000, 'budgetMax': 10000,
+                                'privateRoom': '有', 'drinkIncluded': '有',
+                            })),
+    'results_top20_score': ('/results', 'area + genre, sort=score limit=20',
+                            lambda d, r: ('POST', '/results?sort=score&limit=20', {
+                                'area': d.area(r), 'genre': d.genre(r),
+                            })),
+    'results_top20_budget': ('/results', 'guests, sort=budget limit=20',
+                             lambda d, r: ('POST', '/results?sort=budget&limit=20', {
+                                 'guests': r.choice((10, 20, 40)),
+                             })),
+    'restaurants_page': ('/api/restaurants', 'GET limit=100',
+                         lambda d, r: ('GET', '/api/restaurants?limit=100', None)),
+    'restaurants_fields': ('/api/restaurants', 'GET limit=500 fields=id,name,area',
+                           lambda d, r: ('GET', '/api/restaurants?limit=500&fields=id,name,area', None)),
+    'restaurants_ndjson': ('/api/restaurants', 'GET format=ndjson limit=1000',
+                           lambda d, r: ('GET', '/api/restaurants?format=ndjson&limit=1000', None)),
+    'restaurants_post': ('/api/restaurants', 'POST area + genre + people',
+                         lambda d, r: ('POST', '/api/restaurants', {
+                             'area': d.area(r), 'genre': d.genre(r), 'people': 10,
+                         })),
+    'restaurant_detail': ('/restaurant/<id>', 'random id',
+                          lambda d, r: ('GET', f'/restaurant/{d.id(r)}', None)),
+    'restaurant_menu': ('/restaurant/<id>/menu', 'random id',
+                        lambda d, r: ('GET', f'/restaurant/{d.id(r)}/menu', None)),
+    'restaurants_batch': ('/api/restaurants/batch', '50 random ids',
+                          lambda d, r: ('POST', '/api/restaurants/batch', {
+                              'ids': [d.id(r) for _ in range(50)],
+                          })),
+    'nearby_k20': ('/api/restaurants/nearby', 'k=20 around a restaurant',
+                   lambda d, r: ('GET', '/api/restaurants/nearby?lat={}&lng={}&k=20'.format(*r.choice(d.points)), None)),
+    'facets_area': ('/api/facets', 'area',
+                    lambda d, r: ('POST', '/api/facets', {'area': d.area(r)})),
+}
+
+
+def percentile(sorted_values, p):
+    # 最近傍順位法によるパーセンタイル
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(p / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def _send(client, method, path, body):
+    response = client.open(path, method=method, json=body)
+    try:
+        # ストリーミング応答も最後まで読み出す
+        response.get_data()
+        return response.status_code
+    finally:
+        response.close()
+
+
+def run_scenario(client, requests, warmup):
+    for method, path, body in requests[:warmup]:
+        _send(client, method, path, body)
+
+    measured = requests[warmup:]
+    latencies = []
+    statuses = Counter()
+    start = time.perf_counter()
+    for method, path, body in measured:
+        request_start = time.perf_counter()
+        status = _send(client, method, path, body)
+        latencies.append((time.perf_counter() - request_start) * 1000)
+        statuses[status] += 1
+    elapsed = time.perf_counter() - start
+
+    # メモリは1リクエストの処理中に増えた量のピーク。tracemalloc のオーバーヘッドが大きいため別に数件だけ実行して測る
+    peak = 0
+    tracemalloc.start()
+    try:
+        for method, path, body in measured[:MEMORY_SAMPLE_REQUESTS]:
+            tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+            _send(client, method, path, body)
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - current)
+    finally:
+        tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        'requests': len(measured),
+        'errors': sum(count for status, count in statuses.items() if status >= 500),
+        'status_codes': {str(status): count for status, count in sorted(statuses.items())},
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'mean_ms': round(sum(latencies) / len(latencies), 3),
+        'max_ms': round(latencies[-1], 3),
+        'throughput_rps': round(len(measured) / elapsed, 2),
+        'peak_memory_bytes': peak,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(database, names, count, warmup, seed, engine, cache):
+    # app を読み込む前に環境変数で対象のデータベースと設定を決める
+    os.environ['DATABASE_PATH'] = database
+    os.environ['SEARCH_ENGINE'] = engine
+    if not cache:
+        os.environ['RESPONSE_CACHE_SIZE'] = '0'
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    from app import app
+
+    dataset = Dataset(database)
+    client = app.test_client()
+    results = {}
+    for name in names:
+        endpoint, shape, build = SCENARIOS[name]
+        # シナリオごとに同じシードから作るので、実行間で同じリクエスト列になる
+        rng = random.Random(f'{seed}:{name}')
+        requests = [build(dataset, rng) for _ in range(warmup + count)]
+        result = run_scenario(client, requests, warmup)
+        results[name] = {'endpoint': endpoint, 'shape': shape, **result}
+        print(f"{name:28} p50={result['p50_ms']:9.3f}ms p95={result['p95_ms']:9.3f}ms "
+              f"p99={result['p99_ms']:9.3f}ms {result['throughput_rps']:9.1f} req/s "
+              f"peak={result['peak_memory_bytes'] / 1024:9.1f}KiB", flush=True)
+
+    meta = {
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'database': database,
+        'rows': dataset.rows,
+        'engine': engine,
+        'cache': cache,
+        'requests': count,
+        'warmup': warmup,
+        'seed': seed,
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+    }
+    if resource is not None:
+        # Linux では KiB 単位
+        meta['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {'meta': meta, 'results': results}
+
+
+def compare_results(baseline, current, threshold=DEFAULT_THRESHOLD, min_delta_ms=DEFAULT_MIN_DELTA_MS):
+    # 両方にあるシナリオについて指標ごとの変化率を出し、threshold を超えて悪化したものを回帰とする
+    rows = []
+    for name, result in current['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        for metric, higher_is_worse in COMPARED_METRICS:
+            old, new = base.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = change > threshold if higher_is_worse else change < -threshold
+            if worse and metric.endswith('_ms') and new - old < min_delta_ms:
+                worse = False
+            if worse and metric.endswith('_bytes') and new - old < MIN_DELTA_BYTES:
+                worse = False
+            rows.append({
+                'scenario': name, 'metric': metric, 'baseline': old, 'current': new,
+                'change': round(change, 4), 'regression': worse,
+            })
+    return rows
+
+
+def print_comparison(rows):
+    for row in rows:
+        flag = 'REGRESSION' if row['regression'] else ''
+        print(f"{row['scenario']:28} {row['metric']:18} {row['baseline']:>14} -> {row['current']:>14} "
+              f"{row['change'] * 100:+8.1f}% {flag}")
+    regressions = [row for row in rows if row['regression']]
+    print(f"{len(regressions)} regression(s) in {len(rows)} comparison(s)")
+    return regressions
+
+
+def _load(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='API をプロセス内で実行してレイテンシ・スループット・メモリを測る')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run = subparsers.add_parser('run', help='ベンチマークを実行して結果を JSON に保存する')
+    run.add_argument('--database', required=True, help='generate_dataset.py で作成したデータベース')
+    run.add_argument('--scenarios', help=f"カンマ区切りのシナリオ名（既定: すべて）: {', '.join(SCENARIOS)}")
+    run.add_argument('--requests', type=int, default=200, help='シナリオごとの計測リクエスト数')
+    run.add_argument('--warmup', type=int, default=20, help='計測前に捨てるリクエスト数')
+    run.add_argument('--seed', type=int, default=0)
+    run.add_argument('--engine', choices=('sql', 'columnar'), default='sql', help='SEARCH_ENGINE の値')
+    run.add_argument('--cache', action='store_true', help='レスポンスキャッシュを有効にする（既定は無効）')
+    run.add_argument('--output', help='結果を保存する JSON ファイル')
+    run.add_argument('--baseline', help='比較対象の結果 JSON（悪化があれば終了コード 1）')
+    run.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+
+    compare = subparsers.add_parser('compare', help='保存済みの結果 JSON 同士を比較する')
+    compare.add_argument('baseline')
+    compare.add_argument('current')
+    compare.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                         help='回帰とみなす悪化率（0.2 = 20%%）')
+    compare.add_argument('--min-delta-ms', type=float, default=DEFAULT_MIN_DELTA_MS,
+                         help='これ未満のレイテンシ差は回帰とみなさない')
+    args = parser.parse_args(argv)
+
+    if args.command == 'compare':
+        rows = compare_results(_load(args.baseline), _load(args.current),
+                               args.threshold, args.min_delta_ms)
+        return 1 if print_comparison(rows) else 0
+
+    names = list(SCENARIOS)
+    if args.scenarios:
+        names = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+        unknown = [name for name in names if name not in SCENARIOS]
+        if unknown:
+            parser.error(f"unknown scenarios: {', '.join(unknown)}")
+    if not os.path.exists(args.database):
+        parser.error(f'database not found: {args.database}')
+
+    report = run_benchmark(args.database, names, args.requests, args.warmup,
+                           args.seed, args.engine, args.cache)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Saved results to {args.output}")
+    if args.baseline:
+        rows = compare_results(_load(args.baseline), report, args.threshold)
+        return 1 if print_comparison(rows) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
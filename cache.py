@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import Response, make_response, request
+
+from db import data_version
+from metrics import add_rows, request_rows
+
+# レスポンスキャッシュの設定（RESPONSE_CACHE_SIZE=0 で無効化）
+CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 256))
+CACHE_TTL = float(os.environ.get('RESPONSE_CACHE_TTL', 60))
+CACHE_MAX_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+# キャッシュしてよいステータスコード（見つからない場合の 404 も同じデータから決まる）
+CACHEABLE_STATUS = (200, 404)
+
+
+class CachedResponse:
+    __slots__ = ('body', 'status', 'content_type', 'etag', 'expires', 'rows')
+
+    def __init__(self, body, status, content_type, etag, expires, rows=0):
+        self.body = body
+        self.status = status
+        self.content_type = content_type
+        self.etag = etag
+        self.expires = expires
+        # 生成時に返却件数として数えた件数（キャッシュから返すときも同じだけ加算する）
+        self.rows = rows
+
+
+class ResponseCache:
+    """シリアライズ済みレスポンスの LRU + TTL キャッシュ。
+
+    データベースの data_version が変わったら全件を破棄する。
+    """
+
+    def __init__(self, maxsize=CACHE_SIZE, ttl=CACHE_TTL, max_bytes=CACHE_MAX_BYTES):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.maxsize > 0
+
+    def _check_version(self, version):
+        if version != self._version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._bytes = 0
+            self._version = version
+
+    def get(self, key, version):
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry, version):
+        size = len(entry.body)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            # 生成中にデータが変わった場合は古い結果を保存しない
+            self._check_version(version)
+            if version != data_version():
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._bytes += size
+            while len(self._entries) > self.maxsize or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= len(entry.body)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'bytes': self._bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
+
+
+response_cache = ResponseCache()
+
+
+def cache_key(namespace, key):
+    # フィルタ辞書などをキー順に並べた文字列にして正規化する
+    return namespace, json.dumps(key, sort_keys=True, ensure_ascii=False, default=str)
+
+
+def _conditional(entry):
+    if entry.etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = Response(entry.body, status=entry.status, content_type=entry.content_type)
+    response.set_etag(entry.etag)
+    return response
+
+
+def _entry(response, rows=0):
+    body = response.get_data()
+    return CachedResponse(
+        body,
+        response.status_code,
+        response.content_type,
+        hashlib.sha1(body).hexdigest(),
+        time.monotonic() + response_cache.ttl,
+        rows,
+    )
+
+
+def cached_response(namespace, key, build):
+    # build() で作ったレスポンスをキャッシュし、ETag と If-None-Match による 304 応答を付ける
+    # キャッシュが無効（RESPONSE_CACHE_SIZE=0）でも ETag と 304 応答は同じように扱う
+    if not response_cache.enabled:
+        response = make_response(build())
+        if response.status_code not in CACHEABLE_STATUS:
+            return response
+        return _conditional(_entry(response))
+
+    key = cache_key(namespace, key)
+    version = data_version()
+    entry = response_cache.get(key, version)
+    if entry is None:
+        rows = request_rows()
+        response = make_response(build())
+        if response.status_code not in CACHEABLE_STATUS:
+            return response
+        entry = _entry(response, request_rows() - rows)
+        response_cache.put(key, entry, version)
+    else:
+        add_rows(entry.rows)
+    return _conditional(entry)
@@ -0,0 +1,195 @@
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# データベースの設定（環境変数で上書き可能）
+DATABASE_PATH = os.environ.get('DATABASE_PATH', 'example.db')
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+# プールの接続がすべて使用中のとき、返却を待つ最大秒数
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 5))
+MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB', 16 * 1024))
+STATEMENT_CACHE_SIZE = int(os.environ.get('SQLITE_STATEMENT_CACHE_SIZE', 256))
+
+
+def connect(path=None, readonly=False):
+    # WAL モードと各種 PRAGMA を設定した接続を作成する
+    conn = sqlite3.connect(
+        path or DATABASE_PATH,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA mmap_size={MMAP_SIZE}')
+    conn.execute(f'PRAGMA cache_size=-{CACHE_SIZE_KB}')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA busy_timeout=5000')
+    if readonly:
+        # 読み取り専用の経路では書き込みを禁止する
+        conn.execute('PRAGMA query_only=ON')
+    return conn
+
+
+class PoolTimeout(Exception):
+    """プールの接続が POOL_TIMEOUT 秒以内に空かなかったことを表す例外。"""
+
+
+class ConnectionPool:
+    """使い回し可能な SQLite 接続のプール。
+
+    接続は作成時に WAL モードと各種 PRAGMA を設定し、リクエストをまたいで再利用する。
+    sqlite3 の接続ごとのステートメントキャッシュにより、同じ SQL の再パースも避けられる。
+    """
+
+    def __init__(self, path, size=POOL_SIZE, readonly=True, timeout=POOL_TIMEOUT):
+        self.path = path
+        self.size = size
+        self.readonly = readonly
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._lock = threading.Lock()
+        self._created = 0
+        self._acquired = 0
+        self._reused = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._in_use = 0
+
+    def _connect(self):
+        return connect(self.path, self.readonly)
+
+    def acquire(self):
+        with self._lock:
+            self._acquired += 1
+            self._in_use += 1
+            try:
+                conn = self._idle.get_nowait()
+                self._reused += 1
+                return conn
+            except queue.Empty:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+                else:
+                    self._waits += 1
+        if create:
+            try:
+                return self._connect()
+            except sqlite3.Error:
+                with self._lock:
+                    self._created -= 1
+                    self._in_use -= 1
+                raise
+        # 上限に達している場合は返却を待つ（timeout 秒を過ぎたら PoolTimeout）
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            with self._lock:
+                self._in_use -= 1
+                self._timeouts += 1
+            raise PoolTimeout(f'{self.timeout} 秒以内にデータベース接続を確保できませんでした') from None
+
+    def release(self, conn):
+        if not self.readonly and conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            self._in_use -= 1
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        with self._lock:
+            while True:
+                try:
+                    self._idle.get_nowait().close()
+                except queue.Empty:
+                    break
+                self._created -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'path': self.path,
+                'readonly': self.readonly,
+                'size': self.size,
+                'created': self._created,
+                'idle': self._idle.qsize(),
+                'in_use': self._in_use,
+                'acquired': self._acquired,
+                'reused': self._reused,
+                'waits': self._waits,
+                'timeouts': self._timeouts,
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(readonly=True):
+    with _pools_lock:
+        pool = _pools.get(readonly)
+        if pool is None:
+            pool = ConnectionPool(DATABASE_PATH, readonly=readonly)
+            _pools[readonly] = pool
+        return pool
+
+
+@contextmanager
+def get_connection(readonly=True):
+    with get_pool(readonly).connection() as conn:
+        yield conn
+
+
+@contextmanager
+def get_dedicated_connection(readonly=True):
+    # プールの外で接続を開き、使い終わったら閉じる
+    # ストリーミング応答のように、クライアントの速度しだいで長く保持される接続に使う
+    conn = connect(DATABASE_PATH, readonly)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+_monitor = None
+_monitor_lock = threading.Lock()
+
+
+def data_version():
+    # 他の接続がコミットするたびに値が変わる（キャッシュや検索エンジンの再構築判定に使う）
+    global _monitor
+    with _monitor_lock:
+        if _monitor is None:
+            _monitor = sqlite3.connect(DATABASE_PATH, check_same_thread=False)
+            _monitor.execute('PRAGMA query_only=ON')
+        return _monitor.execute('PRAGMA data_version').fetchone()[0]
+
+
+def pool_stats():
+    with _pools_lock:
+        pools = list(_pools.values())
+    return {'read' if p.readonly else 'write': p.stats() for p in pools}
+
+
+def close_pools():
+    global _monitor
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+    with _monitor_lock:
+        if _monitor is not None:
+            _monitor.close()
+            _monitor = None
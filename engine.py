@@ -0,0 +1,331 @@
+import logging
+import re
+import threading
+from operator import itemgetter
+
+try:
+    import numpy as np
+except ImportError:  # numpy が無い環境では SQL 検索のみを使う
+    np = None
+
+from db import data_version, get_connection
+from init_db import SCORE_PRIOR_RATING, SCORE_PRIOR_REVIEWS
+from payloads import IN_CHUNK_SIZE
+from search import has_table
+
+NUMERIC_COLUMNS = ('capacity', 'budget_min', 'budget_max')
+# 並び替えでのみ使う数値列（初回の並び替え時に配列化する）
+RANKING_COLUMNS = ('tabelog_rating', 'tabelog_reviews', 'google_rating', 'google_reviews')
+CATEGORICAL_COLUMNS = ('area', 'has_private_room', 'has_drink_all_included')
+# メモリに読み込む列（フィルタと並び替えに使う列のみ。結果の行は id で読み直す）
+ENGINE_COLUMNS = ('id', 'category') + CATEGORICAL_COLUMNS + NUMERIC_COLUMNS + RANKING_COLUMNS
+
+# SQLite の LIKE と同じく ASCII のみ大文字小文字を区別しない
+_ASCII_LOWER = str.maketrans('ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz')
+
+
+def ascii_lower(text):
+    return text.translate(_ASCII_LOWER)
+
+
+def like_pattern(pattern):
+    # LIKE のパターン（% と _）を正規表現に変換する
+    regex = ''.join(
+        '.*' if ch == '%' else '.' if ch == '_' else re.escape(ch)
+        for ch in ascii_lower(pattern)
+    )
+    return re.compile(regex, re.DOTALL)
+
+
+# 数値の列と比較するときに SQLite が数値に変換する文字列（全角数字や inf・nan は文字列のまま）
+_NUMERIC_TEXT = re.compile(r'\s*[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?\s*', re.ASCII)
+
+
+def to_number(value):
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        if _NUMERIC_TEXT.fullmatch(value) is None:
+            return None
+        return float(value)
+    raise TypeError(f'unsupported filter value: {value!r}')
+
+
+def to_text(value):
+    # TEXT 列との比較では SQLite と同様に数値を文字列として扱う
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, (int, float)):
+        return str(value)
+    if isinstance(value, str):
+        return value
+    raise TypeError(f'unsupported filter value: {value!r}')
+
+
+def fetch_rows(conn, ids, columns='*'):
+    # 選ばれた id の行だけをまとめて取得し (列名, {id: 行}) を返す（パラメータ上限に合わせて分割）
+    rows = {}
+    cursor = conn.execute(f'SELECT {columns} FROM restaurants LIMIT 0')
+    column_names = [desc[0] for desc in cursor.description]
+    id_index = column_names.index('id')
+    for start in range(0, len(ids), IN_CHUNK_SIZE):
+        chunk = ids[start:start + IN_CHUNK_SIZE]
+        placeholders = ', '.join('?' * len(chunk))
+        for row in conn.execute(f'SELECT {columns} FROM restaurants WHERE id IN ({placeholders})', chunk):
+            rows[row[id_index]] = row
+    return column_names, rows
+
+
+class _Snapshot:
+    """restaurants テーブルのフィルタ・並び替え用の列を列ごとの配列に展開したもの。"""
+
+    def __init__(self, column_names, rows):
+        self.column_names = column_names
+        self.rows = rows
+        index = {name: i for i, name in enumerate(column_names)}
+        self.index = index
+        size = len(rows)
+        self.size = size
+        self.ids = np.fromiter((row[index['id']] for row in rows), dtype=np.int64, count=size)
+
+        # 数値列: NULL は NaN、数値に変換できない文字列は別フラグで持つ
+        self.numeric = {}
+        for name in NUMERIC_COLUMNS:
+            self.numeric[name] = self._numeric_column(name)
+        self._sort_keys = {}
+        self._text_ranks = {}
+
+        # カテゴリ列: 値ごとにコードを振る（NULL は -1）
+        self.categorical = {}
+        for name in CATEGORICAL_COLUMNS + ('category',):
+            i = index[name]
+            codes = np.empty(size, dtype=np.int32)
+            values = {}
+            for n, row in enumerate(rows):
+                value = row[i]
+                codes[n] = -1 if value is None else values.setdefault(value, len(values))
+            self.categorical[name] = (codes, values)
+
+        # カテゴリ文字列ごとの ASCII 小文字化済み文字列（ジャンルの部分一致判定用）
+        _, categories = self.categorical['category']
+        self.category_texts = [
+            ascii_lower(str(value)) for value in categories
+        ]
+        self._genre_masks = {}
+
+    def _numeric_column(self, name):
+        i = self.index[name]
+        values = np.full(self.size, np.nan)
+        is_text = np.zeros(self.size, dtype=bool)
+        for n, row in enumerate(self.rows):
+            value = row[i]
+            if isinstance(value, (int, float)):
+                values[n] = value
+            elif isinstance(value, str):
+                is_text[n] = True
+        return values, is_text
+
+    def _numeric(self, name):
+        if name not in self.numeric:
+            self.numeric[name] = self._numeric_column(name)
+        return self.numeric[name]
+
+    def _text_rank(self, name):
+        # 文字列が入っている行の、文字列同士での昇順の順位（SQLite の BINARY 照合と同じくコードポイント順）
+        ranks = self._text_ranks.get(name)
+        if ranks is None:
+            i = self.index[name]
+            _, is_text = self._numeric(name)
+            rows = np.flatnonzero(is_text)
+            positions = {text: n for n, text in enumerate(sorted({self.rows[n][i] for n in rows}))}
+            ranks = np.zeros(self.size)
+            for n in rows:
+                ranks[n] = positions[self.rows[n][i]]
+            self._text_ranks[name] = ranks
+        return ranks
+
+    def _descending_keys(self, name):
+        # ORDER BY name DESC と同じ順になる昇順のキー（文字列が先頭、NULL が末尾）
+        # 文字列同士は第2キーで文字列の降順にする
+        values, is_text = self._numeric(name)
+        key = np.where(np.isnan(values), np.inf, -values)
+        key[is_text] = -np.inf
+        return [key, -self._text_rank(name)]
+
+    def _score(self):
+        # init_db.SCORE_EXPRESSION と同じ計算（NULL を含む積は 0、数値でない文字列は 0 とみなす）
+        numerator = np.zeros(self.size)
+        denominator = np.zeros(self.size)
+        for rating_name, reviews_name in (('tabelog_rating', 'tabelog_reviews'),
+                                          ('google_rating', 'google_reviews')):
+            rating, rating_is_text = self._numeric(rating_name)
+            reviews, reviews_is_text = self._numeric(reviews_name)
+            rating = np.where(rating_is_text, 0.0, rating)
+            reviews = np.where(reviews_is_text, 0.0, reviews)
+            rated = ~np.isnan(rating)
+            numerator = numerator + np.nan_to_num(rating * reviews, nan=0.0)
+            denominator = denominator + np.nan_to_num(reviews * rated, nan=0.0)
+        return ((numerator + SCORE_PRIOR_RATING * SCORE_PRIOR_REVIEWS)
+                / (denominator + SCORE_PRIOR_REVIEWS))
+
+    def sort_keys(self, sort):
+        # search.SORT_ORDERS と同じ並びになる昇順のキー配列（先頭が第1キー、最後は id）
+        keys = self._sort_keys.get(sort)
+        if keys is None:
+            if sort == 'score':
+                keys = [-self._score()]
+            elif sort in ('tabelog_rating', 'google_rating'):
+                keys = self._descending_keys(sort)
+            elif sort == 'budget':
+                budget_min, min_is_text = self.numeric['budget_min']
+                budget_max, max_is_text = self.numeric['budget_max']
+                # budget_min: 数値 < 文字列 < NULL、budget_max: NULL < 数値 < 文字列の順
+                # 文字列同士はそれぞれ次のキーで文字列の昇順にする
+                keys = [
+                    np.where(min_is_text, np.finfo(np.float64).max, np.nan_to_num(budget_min, nan=np.inf)),
+                    self._text_rank('budget_min'),
+                    np.where(max_is_text, np.inf, np.nan_to_num(budget_max, nan=-np.inf)),
+                    self._text_rank('budget_max'),
+                ]
+            else:
+                raise ValueError(f'unsupported sort: {sort}')
+            keys.append(self.ids)
+            self._sort_keys[sort] = keys
+        return keys
+
+    def top_k(self, indices, sort, limit=None):
+        # 第1キーで上位 limit 件の境界値を求め、境界値以下の行だけを並べ替える
+        keys = self.sort_keys(sort)
+        if limit is not None and limit < len(indices):
+            primary = keys[0][indices]
+            threshold = np.partition(primary, limit - 1)[limit - 1]
+            indices = indices[primary <= threshold]
+        order = np.lexsort([key[indices] for key in reversed(keys)])
+        return indices[order][:limit]
+
+    def equals_mask(self, name, value):
+        codes, values = self.categorical[name]
+        code = values.get(to_text(value))
+        if code is None:
+            return np.zeros(self.size, dtype=bool)
+        return codes == code
+
+    def compare_mask(self, name, op, value):
+        values, is_text = self.numeric[name]
+        number = to_number(value)
+        if number is None:
+            # 数値でない文字列との比較では数値は常に小さく、文字列同士は文字列として比較される
+            target = to_text(value)
+            mask = ~np.isnan(values) & ~is_text if op == '<=' else np.zeros(self.size, dtype=bool)
+            i = self.index[name]
+            for n in np.flatnonzero(is_text):
+                text = self.rows[n][i]
+                mask[n] = text >= target if op == '>=' else text <= target
+            return mask
+        with np.errstate(invalid='ignore'):
+            mask = values >= number if op == '>=' else values <= number
+        # 文字列が入っている行は数値より大きいとみなされる
+        return mask | is_text if op == '>=' else mask & ~is_text
+
+    def genre_mask(self, genre):
+        mask = self._genre_masks.get(genre)
+        if mask is None:
+            # カテゴリ文字列ごとの一致表（トークンのビットマップ）を作り、各行のコードで引く
+            pattern = like_pattern(f'%{genre}%')
+            matches = np.fromiter(
+                (pattern.fullmatch(text) is not None for text in self.category_texts),
+                dtype=bool,
+                count=len(self.category_texts),
+            )
+            codes, _ = self.categorical['category']
+            mask = np.zeros(self.size, dtype=bool)
+            present = codes >= 0
+            mask[present] = matches[codes[present]]
+            if len(self._genre_masks) < 1024:
+                self._genre_masks[genre] = mask
+        return mask
+
+    def mask(self, filters):
+        mask = np.ones(self.size, dtype=bool)
+        if filters.get('area'):
+            mask &= self.equals_mask('area', filters['area'])
+        if filters.get('genre'):
+            mask &= self.genre_mask(str(filters['genre']))
+        if filters.get('guests'):
+            mask &= self.compare_mask('capacity', '>=', filters['guests'])
+        if filters.get('budget_min'):
+            mask &= self.compare_mask('budget_min', '>=', filters['budget_min'])
+        if filters.get('budget_max'):
+            mask &= self.compare_mask('budget_max', '<=', filters['budget_max'])
+        if filters.get('private_room'):
+            mask &= self.equals_mask('has_private_room', filters['private_room'])
+        if filters.get('drink_included'):
+            mask &= self.equals_mask('has_drink_all_included', filters['drink_included'])
+        return mask
+
+
+class ColumnarEngine:
+    """restaurants のフィルタ・並び替え用の列をメモリ上の配列に読み込み、ベクトル演算で評価する検索エンジン。
+
+    結果の行は検索のたびに id で読み直す。restaurants の変更は restaurant_changes の最新の seq で検知し
+    （履歴が無いデータベースでは PRAGMA data_version）、変更があれば次の検索時に読み込み直す。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (読み込んだ時点の版, スナップショット) の組
+        self._loaded = (None, None)
+        self.rebuilds = 0
+
+    def _current_version(self, conn):
+        # 店舗以外のテーブル（事前生成したレスポンスなど）だけのコミットでは変わらない値
+        if has_table(conn, 'restaurant_changes'):
+            return 'seq', conn.execute('SELECT MAX(seq) FROM restaurant_changes').fetchone()[0]
+        return 'data_version', data_version()
+
+    def _load(self, conn):
+        rows = conn.execute(f"SELECT {', '.join(ENGINE_COLUMNS)} FROM restaurants ORDER BY id").fetchall()
+        return _Snapshot(list(ENGINE_COLUMNS), rows)
+
+    def snapshot(self, conn):
+        # conn の読み取りトランザクションから見たデータと同じ時点のスナップショットを返す
+        version = self._current_version(conn)
+        loaded_version, snapshot = self._loaded
+        if snapshot is not None and version == loaded_version:
+            return snapshot
+        with self._lock:
+            loaded_version, snapshot = self._loaded
+            if snapshot is None or version != loaded_version:
+                snapshot = self._load(conn)
+                self._loaded = (version, snapshot)
+                self.rebuilds += 1
+                logging.info("検索エンジンを再構築しました: %d 件", snapshot.size)
+            return snapshot
+
+    def search(self, filters, fields=None, after=None, limit=None, sort=None):
+        # SQL 検索と同じ (列名, 行のリスト) を返す（sort を指定しない場合は id 順）
+        with get_connection() as conn:
+            # 絞り込みと行の取得を同じ時点のデータから行う
+            conn.execute('BEGIN')
+            try:
+                snapshot = self.snapshot(conn)
+                indices = np.flatnonzero(snapshot.mask(filters))
+                if after is not None:
+                    indices = indices[snapshot.ids[indices] > after]
+                if sort is not None:
+                    indices = snapshot.top_k(indices, sort, limit)
+                elif limit is not None:
+                    indices = indices[:limit]
+                ids = snapshot.ids[indices].tolist()
+                columns = '*' if not fields else ', '.join(dict.fromkeys(('id', *fields)))
+                column_names, rows = fetch_rows(conn, ids, columns)
+            finally:
+                conn.rollback()
+        # 変更履歴の無いデータベースでは版の確認がトランザクションの外になるため、見つからない行は除く
+        rows = [rows[id] for id in ids if id in rows]
+        if not fields:
+            return column_names, rows
+        getter = itemgetter(*[column_names.index(name) for name in fields])
+        if len(fields) == 1:
+            return list(fields), [(getter(row),) for row in rows]
+        return list(fields), [getter(row) for row in rows]
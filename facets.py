@@ -0,0 +1,297 @@
+import logging
+import re
+import threading
+
+from db import data_version, get_connection
+from engine import ascii_lower, like_pattern, to_number, to_text
+from payloads import IN_CHUNK_SIZE
+from search import has_table
+
+# ファセット集計に使う列（id の次に並べた順で読み込む）
+FACET_COLUMNS = (
+    'area', 'category', 'capacity', 'budget_min', 'budget_max',
+    'has_private_room', 'has_drink_all_included',
+)
+_SELECT = f"SELECT id, {', '.join(FACET_COLUMNS)} FROM restaurants"
+
+# 予算（budget_min）の区切り。'-1000', '1000-2000', ..., '10000-' のバケットに分ける
+BUDGET_BUCKETS = (1000, 2000, 3000, 4000, 5000, 6000, 8000, 10000)
+
+# カテゴリ文字列をジャンルに分ける区切り文字
+GENRE_SEPARATORS = re.compile(r'[、,，・/／\s]+')
+
+# 一度に差分適用する変更件数の上限（超えた場合は全件読み直す）
+MAX_INCREMENTAL_CHANGES = 10000
+
+
+def _bitmap(positions, size):
+    # 位置のリストから int のビットマップを作る（1ビットずつ OR するより速い）
+    buf = bytearray((size + 7) // 8)
+    for pos in positions:
+        buf[pos >> 3] |= 1 << (pos & 7)
+    return int.from_bytes(buf, 'little')
+
+
+def _satisfies(value, op, target):
+    # SQLite の INTEGER 列との比較と同じ判定（NULL は不一致、文字列は数値より大きい）
+    if value is None:
+        return False
+    number = to_number(target)
+    if number is not None:
+        if isinstance(value, str):
+            return op == '>='
+        return value >= number if op == '>=' else value <= number
+    if not isinstance(value, str):
+        return op == '<='
+    target = to_text(target)
+    return value >= target if op == '>=' else value <= target
+
+
+def budget_buckets():
+    bounds = (None,) + BUDGET_BUCKETS + (None,)
+    return [
+        (f"{low or ''}-{high or ''}", low, high)
+        for low, high in zip(bounds, bounds[1:])
+    ]
+
+
+class FacetIndex:
+    """列の値ごとのビットマップ（int）で、フィルタごとの件数を集計する。
+
+    変更は restaurant_changes の履歴から差分で反映し、履歴が追えない場合は全件読み直す。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._last_seq = None
+        self._positions = {}
+        self._values = []
+        self._live = 0
+        self._bitmaps = {}
+        self._cache = {}
+        self.rebuilds = 0
+        self.updates = 0
+
+    # --- 構築と差分更新 ---
+
+    def _set_bits(self, pos, values):
+        bit = 1 << pos
+        for name, value in zip(FACET_COLUMNS, values):
+            if value is not None:
+                bitmaps = self._bitmaps[name]
+                bitmaps[value] = bitmaps.get(value, 0) | bit
+        self._live |= bit
+
+    def _clear_bits(self, pos, values):
+        mask = ~(1 << pos)
+        for name, value in zip(FACET_COLUMNS, values):
+            if value is not None:
+                bitmaps = self._bitmaps[name]
+                remaining = bitmaps[value] & mask
+                if remaining:
+                    bitmaps[value] = remaining
+                else:
+                    del bitmaps[value]
+        self._live &= mask
+
+    def _rebuild(self, conn):
+        rows = conn.execute(f'{_SELECT} ORDER BY id').fetchall()
+        size = len(rows)
+        positions = {}
+        for i, name in enumerate(FACET_COLUMNS, 1):
+            groups = {}
+            for pos, row in enumerate(rows):
+                if row[i] is not None:
+                    groups.setdefault(row[i], []).append(pos)
+            self._bitmaps[name] = {value: _bitmap(group, size) for value, group in groups.items()}
+        for pos, row in enumerate(rows):
+            positions[row[0]] = pos
+        self._positions = positions
+        self._values = [row[1:] for row in rows]
+        self._live = (1 << size) - 1
+        self.rebuilds += 1
+        logging.info("ファセット集計を再構築しました: %d 件", size)
+
+    def _apply(self, conn, ids):
+        current = {}
+        for start in range(0, len(ids), IN_CHUNK_SIZE):
+            chunk = ids[start:start + IN_CHUNK_SIZE]
+            placeholders = ', '.join('?' * len(chunk))
+            for row in conn.execute(f'{_SELECT} WHERE id IN ({placeholders})', chunk):
+                current[row[0]] = row[1:]
+        for id in ids:
+            pos = self._positions.get(id)
+            if pos is not None:
+                self._clear_bits(pos, self._values[pos])
+                self._values[pos] = None
+            values = current.get(id)
+            if values is None:
+                self._positions.pop(id, None)
+                continue
+            if pos is None:
+                pos = self._positions[id] = len(self._values)
+                self._values.append(None)
+            self._values[pos] = values
+            self._set_bits(pos, values)
+        self.updates += 1
+
+    def _sync(self, conn):
+        # 前回以降の変更履歴を読み、差分で反映できなければ全件読み直す
+        if not has_table(conn, 'restaurant_changes'):
+            self._rebuild(conn)
+            return
+        low, high = conn.execute('SELECT MIN(seq), MAX(seq) FROM restaurant_changes').fetchone()
+        last_seq = self._last_seq
+        if last_seq is not None and high is not None and low <= last_seq + 1 <= high + 1:
+            changes = conn.execute(
+                'SELECT restaurant_id FROM restaurant_changes WHERE seq > ? AND seq <= ? ORDER BY seq',
+                (last_seq, high),
+            ).fetchall()
+            ids = list(dict.fromkeys(row[0] for row in changes))
+            if None not in ids and len(ids) <= MAX_INCREMENTAL_CHANGES:
+                self._apply(conn, ids)
+                # 削除で空いた位置が増えすぎたら詰め直す
+                if len(self._values) > 2 * len(self._positions) + 1024:
+                    self._rebuild(conn)
+                self._last_seq = high
+                return
+        self._rebuild(conn)
+        self._last_seq = high or 0
+
+    def _refresh(self):
+        version = data_version()
+        if version == self._version:
+            return
+        with get_connection() as conn:
+            # 変更履歴と行を同じ時点のデータから読む
+            conn.execute('BEGIN')
+            try:
+                self._sync(conn)
+            finally:
+                conn.rollback()
+        self._version = version
+        self._cache.clear()
+
+    # --- フィルタのビットマップ ---
+
+    def _cached(self, key, build):
+        bitmap = self._cache.get(key)
+        if bitmap is None:
+            bitmap = build()
+            if len(self._cache) < 4096:
+                self._cache[key] = bitmap
+        return bitmap
+
+    def _union(self, name, predicate):
+        bitmap = 0
+        for value, bits in self._bitmaps[name].items():
+            if predicate(value):
+                bitmap |= bits
+        return bitmap
+
+    def _equals(self, name, value):
+        return self._bitmaps[name].get(to_text(value), 0)
+
+    def _compare(self, name, op, target):
+        return self._cached(
+            (name, op, target),
+            lambda: self._union(name, lambda value: _satisfies(value, op, target)),
+        )
+
+    def _genre(self, genre):
+        pattern = like_pattern(f'%{genre}%')
+        return self._cached(
+            ('genre', genre),
+            lambda: self._union('category', lambda value: pattern.fullmatch(ascii_lower(str(value))) is not None),
+        )
+
+    def _genres(self):
+        # カテゴリ文字列を区切ってジャンルの一覧を作り、ジャンルごとのビットマップを返す
+        # 件数は genre で絞り込んだ場合と同じ（部分一致・ASCII の大文字小文字を区別しない）
+        genres = self._cache.get('genres')
+        if genres is None:
+            genres = {}
+            for value in self._bitmaps['category']:
+                for genre in GENRE_SEPARATORS.split(str(value)):
+                    if genre and genre not in genres:
+                        genres[genre] = self._genre(genre)
+            self._cache['genres'] = genres
+        return genres
+
+    def _filter_bitmaps(self, filters):
+        # ファセットごとに、そのファセット自身の条件のビットマップを返す
+        selected = {}
+        if filters.get('area'):
+            selected['area'] = self._equals('area', filters['area'])
+        if filters.get('genre'):
+            selected['genre'] = self._genre(str(filters['genre']))
+        if filters.get('guests'):
+            selected['guests'] = self._compare('capacity', '>=', filters['guests'])
+        budget = self._live
+        if filters.get('budget_min'):
+            budget &= self._compare('budget_min', '>=', filters['budget_min'])
+        if filters.get('budget_max'):
+            budget &= self._compare('budget_max', '<=', filters['budget_max'])
+        if budget != self._live:
+            selected['budget'] = budget
+        if filters.get('private_room'):
+            selected['privateRoom'] = self._equals('has_private_room', filters['private_room'])
+        if filters.get('drink_included'):
+            selected['drinkIncluded'] = self._equals('has_drink_all_included', filters['drink_included'])
+        return selected
+
+    # --- 集計 ---
+
+    def counts(self, filters):
+        # 各ファセットの件数は、そのファセット以外の条件をすべて満たす行について数える
+        with self._lock:
+            self._refresh()
+            selected = self._filter_bitmaps(filters)
+
+            def base(excluded):
+                bitmap = self._live
+                for name, bits in selected.items():
+                    if name != excluded:
+                        bitmap &= bits
+                return bitmap
+
+            def count_values(bitmaps, excluded):
+                matched = base(excluded)
+                return {str(value): (bits & matched).bit_count() for value, bits in bitmaps.items()}
+
+            budget_base = base('budget')
+            budget = []
+            for label, low, high in budget_buckets():
+                bits = self._cached(('bucket', label), lambda: self._union('budget_min', lambda value: (
+                    not isinstance(value, str)
+                    and (low is None or value >= low) and (high is None or value < high)
+                )))
+                budget.append({
+                    'label': label, 'min': low, 'max': high,
+                    'count': (bits & budget_base).bit_count(),
+                })
+
+            return {
+                'total': base(None).bit_count(),
+                'facets': {
+                    'area': count_values(self._bitmaps['area'], 'area'),
+                    'genre': count_values(self._genres(), 'genre'),
+                    'budget': budget,
+                    'privateRoom': count_values(self._bitmaps['has_private_room'], 'privateRoom'),
+                    'drinkIncluded': count_values(self._bitmaps['has_drink_all_included'], 'drinkIncluded'),
+                },
+            }
+
+    def stats(self):
+        with self._lock:
+            return {
+                'rows': len(self._positions),
+                'slots': len(self._values),
+                'values': {name: len(bitmaps) for name, bitmaps in self._bitmaps.items()},
+                'rebuilds': self.rebuilds,
+                'updates': self.updates,
+            }
+
+
+facet_index = FacetIndex()
@@ -0,0 +1,186 @@
+import argparse
+import json
+import math
+import random
+import time
+
+from db import connect
+from init_db import create_derived_objects, create_restaurants_table
+from load_data import DEFAULT_BATCH_SIZE, batched
+
+# ベンチマーク用の規模（--size で指定）
+SIZES = {'small': 1000, 'medium': 100000, 'large': 1000000}
+
+# エリアごとの中心座標・最寄り駅・出現しやすさ（重み）
+AREAS = (
+    ('新宿', 35.6909, 139.7003, ('新宿', '新宿三丁目', '西新宿', '新宿御苑前'), 12),
+    ('渋谷', 35.6580, 139.7016, ('渋谷', '神泉', '表参道'), 10),
+    ('池袋', 35.7295, 139.7109, ('池袋', '東池袋', '要町'), 8),
+    ('銀座', 35.6717, 139.7650, ('銀座', '銀座一丁目', '東銀座', '有楽町'), 7),
+    ('新橋', 35.6663, 139.7583, ('新橋', '汐留', '内幸町'), 7),
+    ('上野', 35.7138, 139.7770, ('上野', '御徒町', '上野広小路'), 5),
+    ('品川', 35.6285, 139.7388, ('品川', '北品川', '高輪台'), 4),
+    ('恵比寿', 35.6467, 139.7101, ('恵比寿', '広尾', '代官山'), 4),
+    ('六本木', 35.6628, 139.7314, ('六本木', '六本木一丁目', '乃木坂'), 4),
+    ('秋葉原', 35.6984, 139.7731, ('秋葉原', '末広町', '岩本町'), 3),
+    ('吉祥寺', 35.7030, 139.5795, ('吉祥寺', '井の頭公園'), 2),
+    ('横浜', 35.4658, 139.6223, ('横浜', '関内', 'みなとみらい'), 3),
+)
+AREA_WEIGHTS = tuple(area[-1] for area in AREAS)
+
+# ジャンルと代表的な料理・出現しやすさ（重み）
+CATEGORIES = (
+    ('居酒屋', ('唐揚げ', '枝豆', 'だし巻き玉子', '刺身盛り合わせ', 'ポテトサラダ'), 15),
+    ('焼鳥', ('ねぎま', 'つくね', '皮', 'レバー', 'ぼんじり'), 6),
+    ('焼肉', ('上カルビ', 'ハラミ', '牛タン塩', 'ホルモン', 'ビビンバ'), 6),
+    ('寿司', ('まぐろ', 'サーモン', 'いくら', '穴子', '茶碗蒸し'), 4),
+    ('和食', ('天ぷら盛り合わせ', '焼き魚', '炊き込みご飯', '茶碗蒸し'), 4),
+    ('イタリアン', ('マルゲリータ', 'カルボナーラ', 'カプレーゼ', 'ティラミス'), 5),
+    ('中華', ('餃子', '麻婆豆腐', '小籠包', '炒飯', 'エビチリ'), 4),
+    ('韓国料理', ('サムギョプサル', 'チヂミ', 'チーズタッカルビ', 'キムチ'), 3),
+    ('ダイニングバー', ('生ハム', 'フライドポテト', 'アヒージョ', 'ピザ'), 4),
+    ('もつ鍋', ('もつ鍋（醤油）', 'もつ鍋（味噌）', '酢もつ', 'ちゃんぽん麺'), 2),
+    ('しゃぶしゃぶ', ('豚しゃぶ', '牛しゃぶ', '野菜盛り合わせ', '雑炊'), 2),
+    ('ビストロ', ('パテ・ド・カンパーニュ', 'ステーキフリット', 'キッシュ'), 2),
+    ('Bar', ('ミックスナッツ', 'チーズ盛り合わせ', 'チョコレート'), 1),
+)
+CATEGORY_WEIGHTS = tuple(category[-1] for category in CATEGORIES)
+
+DRINKS = ('生ビール', 'ハイボール', 'レモンサワー', '日本酒', '焼酎', 'ワイン（グラス）', 'ウーロン茶', 'コーラ')
+COURSES = ('宴会コース', '飲み放題付きコース', '歓送迎会プラン', '女子会プラン', '季節のおまかせコース')
+STREETS = ('一丁目', '二丁目', '三丁目', '四丁目', '五丁目')
+
+
+def _review_count(rng):
+    # 口コミ件数は少数の人気店に偏るため対数正規分布で作る
+    return int(rng.lognormvariate(4.0, 1.2))
+
+
+def generate_restaurant(rng, id):
+    # init_db.py の restaurants テーブルと同じ列の辞書を1件作る
+    area, lat, lng, stations, _ = rng.choices(AREAS, AREA_WEIGHTS)[0]
+    category, dishes, _ = rng.choices(CATEGORIES, CATEGORY_WEIGHTS)[0]
+    if rng.random() < 0.15:
+        # 一部の店舗は「居酒屋・焼鳥」のように複数のジャンルを持つ
+        other = rng.choices(CATEGORIES, CATEGORY_WEIGHTS)[0][0]
+        if other != category:
+            category = f'{category}・{other}'
+
+    # 中心から最大 1.5km 程度に散らばらせる
+    distance = abs(rng.gauss(0, 500))
+    angle = rng.random() * 2 * math.pi
+    latitude = lat + distance * math.cos(angle) / 111320
+    longitude = lng + distance * math.sin(angle) / (111320 * math.cos(math.radians(lat)))
+
+    budget_min = rng.choice(range(1000, 8001, 500))
+    budget_max = budget_min + rng.choice(range(1000, 5001, 500))
+    capacity = min(int(rng.lognormvariate(3.3, 0.6)), 300)
+    food_menu = [
+        {'name': dish, 'price': rng.choice(range(380, 2001, 10))}
+        for dish in rng.sample(dishes, rng.randint(2, len(dishes)))
+    ]
+    drink_menu = [
+        {'name': drink, 'price': rng.choice(range(300, 901, 10))}
+        for drink in rng.sample(DRINKS, rng.randint(3, len(DRINKS)))
+    ]
+    station = rng.choice(stations)
+    city = '神奈川県横浜市' if area == '横浜' else f'東京都{area}'
+    has_photos = rng.random() < 0.8
+
+    return {
+        'id': id,
+        'name': f'{category.split("・")[0]} {station} {id}号店',
+        'address': f'{city}{rng.choice(STREETS)}{rng.randint(1, 30)}-{rng.randint(1, 20)}',
+        'phone': f'03-{rng.randint(1000, 9999)}-{rng.randint(1000, 9999)}',
+        'tabelog_rating': round(min(max(rng.gauss(3.4, 0.25), 3.0), 4.5), 2),
+        'tabelog_reviews': _review_count(rng),
+        'tabelog_link': f'https://tabelog.com/tokyo/A{rng.randint(1301, 1331)}/{10000000 + id}/',
+        'google_rating': round(min(max(rng.gauss(3.9, 0.35), 2.5), 5.0), 1),
+        'google_reviews': _review_count(rng),
+        'google_link': f'https://maps.google.com/?cid={rng.getrandbits(63)}',
+        'opening_hours': rng.choice(('17:00-23:00', '17:00-翌1:00', '11:30-14:00, 17:00-23:00', '16:00-24:00')),
+        'course': json.dumps(rng.sample(COURSES, rng.randint(0, 3)), ensure_ascii=False),
+        'menu': json.dumps(food_menu, ensure_ascii=False),
+        'drink_menu': json.dumps(drink_menu, ensure_ascii=False),
+        'store_top_image': f'https://example.com/images/{id}/top.jpg' if has_photos else None,
+        'description': f'{station}駅から徒歩{rng.randint(1, 10)}分の{category}。宴会・貸切のご相談も承ります。',
+        'longitude': round(longitude, 7),
+        'latitude': round(latitude, 7),
+        'area': area,
+        'nearest_station': station,
+        'directions': f'{station}駅 {rng.choice("ABCDE")}{rng.randint(1, 9)}出口より徒歩{rng.randint(1, 10)}分',
+        'capacity': max(capacity, 4),
+        'category': category,
+        'budget_min': budget_min,
+        'budget_max': budget_max,
+        'has_private_room': '有' if rng.random() < 0.45 else '無',
+        'has_drink_all_included': '有' if rng.random() < 0.6 else '無',
+        'detail_image1': f'https://example.com/images/{id}/1.jpg' if has_photos else None,
+        'detail_image2': f'https://example.com/images/{id}/2.jpg' if has_photos else None,
+        'detail_image3': None,
+    }
+
+
+def generate_restaurants(rows, seed=0):
+    rng = random.Random(seed)
+    for id in range(1, rows + 1):
+        yield generate_restaurant(rng, id)
+
+
+def write_jsonl(path, records):
+    # load_data.py でそのまま読み込める JSONL を出力する
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            count += 1
+    return count
+
+
+def write_database(path, records, batch_size=DEFAULT_BATCH_SIZE):
+    # 新しいデータベースを作成して書き込み、インデックス・検索用テーブルを作る
+    conn = connect(path)
+    # 作り直せるデータなので書き込みの同期を省略する
+    conn.execute('PRAGMA synchronous=OFF')
+    c = conn.cursor()
+    c.execute('DROP TABLE IF EXISTS restaurants')
+    create_restaurants_table(c)
+    count = 0
+    statement = None
+    for batch in batched(records, batch_size):
+        if statement is None:
+            columns = list(batch[0])
+            statement = (f"INSERT INTO restaurants ({', '.join(columns)}) "
+                         f"VALUES ({', '.join('?' * len(columns))})")
+        c.executemany(statement, [tuple(record[name] for name in columns) for record in batch])
+        count += len(batch)
+    create_derived_objects(c)
+    c.execute('ANALYZE')
+    conn.commit()
+    conn.close()
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='ベンチマーク用の restaurants データセットを生成する')
+    parser.add_argument('output', help='出力先（.db / .sqlite はデータベース、.jsonl は load_data.py 用のファイル）')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--size', choices=SIZES, default='small',
+                       help='small=1千件 / medium=10万件 / large=100万件')
+    group.add_argument('--rows', type=int, help='件数を直接指定する')
+    parser.add_argument('--seed', type=int, default=0, help='乱数のシード（同じ値なら同じデータになる）')
+    args = parser.parse_args(argv)
+
+    rows = args.rows if args.rows is not None else SIZES[args.size]
+    records = generate_restaurants(rows, args.seed)
+    start = time.perf_counter()
+    if args.output.endswith(('.jsonl', '.ndjson')):
+        count = write_jsonl(args.output, records)
+    else:
+        count = write_database(args.output, records)
+    elapsed = time.perf_counter() - start
+    print(f"Generated {count} rows into {args.output} in {elapsed:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+import math
+
+from db import get_connection
+from engine import fetch_rows, to_number
+from metrics import timed
+from search import build_where, has_table
+
+EARTH_RADIUS_M = 6371008.8
+
+# 近隣検索の既定半径と、k 件検索の探索範囲（KNN_INITIAL_K 件あたりの初期値・下限・上限、メートル）
+DEFAULT_RADIUS_M = 1000
+KNN_INITIAL_RADIUS_M = 200
+KNN_INITIAL_K = 20
+KNN_MIN_RADIUS_M = 10
+KNN_MAX_RADIUS_M = 50000
+# 最初の探索で読み込む候補が k 件のこの倍数を超える場合は半径を縮める
+KNN_MAX_CANDIDATES = 8
+
+# R*Tree に保存された座標の丸め誤差から生じる距離の誤差の上限（メートル）
+RTREE_TOLERANCE_M = 5
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    # 2点間の大円距離（メートル）
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(lat, lng, radius):
+    # 半径 radius の円を含む緯度経度の矩形
+    # haversine と同じ球で計算する（経度方向は円に接する大円の経度差）
+    angle = radius / EARTH_RADIUS_M
+    dlat = math.degrees(angle)
+    ratio = math.sin(angle) / max(math.cos(math.radians(lat)), 0.01)
+    dlng = 180.0 if ratio >= 1 else math.degrees(math.asin(ratio))
+    return lat - dlat, lat + dlat, lng - dlng, lng + dlng
+
+
+def _box_query(conn, filters, lat, lng, radius, select):
+    # 半径 radius の円を含む矩形内の店舗を選ぶクエリ（空間インデックスがあれば使う）
+    min_lat, max_lat, min_lng, max_lng = bounding_box(lat, lng, radius)
+    where, params = build_where(conn, filters, ranked=True)
+    if has_table(conn, 'restaurants_rtree'):
+        # 絞り込み条件がある場合だけ restaurants を結合する
+        join = '' if where == '1=1' else ' JOIN restaurants ON restaurants.id = t.id'
+        query = (f'SELECT {select[0]} FROM restaurants_rtree t{join}'
+                 ' WHERE t.min_lat <= ? AND t.max_lat >= ? AND t.min_lng <= ? AND t.max_lng >= ?'
+                 f' AND {where}')
+        return query, [max_lat, min_lat, max_lng, min_lng] + params
+    query = (f'SELECT {select[1]} FROM restaurants'
+             f' WHERE latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ? AND {where}')
+    return query, [min_lat, max_lat, min_lng, max_lng] + params
+
+
+def _count(conn, filters, lat, lng, radius):
+    # 矩形内の件数だけを数える（行を Python に読み込まないので候補の読み込みより軽い）
+    query, params = _box_query(conn, filters, lat, lng, radius, ('count(*)', 'count(*)'))
+    with timed('query', (query, params)):
+        return conn.execute(query, params).fetchone()[0]
+
+
+def _candidates(conn, filters, lat, lng, radius):
+    # 矩形内の候補を空間インデックスで絞り込み、id と座標だけから (おおよその距離, id) を返す
+    # R*Tree の座標は 32bit 浮動小数に丸められているため、半径に RTREE_TOLERANCE_M の余裕を持たせる
+    # 店舗の全列は読まない（上位の行だけ後で fetch_rows で取得し、正確な距離で並べ直す）
+    query, params = _box_query(conn, filters, lat, lng, radius, (
+        't.id, (t.min_lat + t.max_lat) / 2, (t.min_lng + t.max_lng) / 2',
+        'id, latitude, longitude',
+    ))
+    with timed('query', (query, params)):
+        results = []
+        for id, row_lat, row_lng in conn.execute(query, params):
+            distance = haversine(lat, lng, row_lat, row_lng)
+            if distance <= radius + RTREE_TOLERANCE_M:
+                results.append((distance, id))
+    return results
+
+
+def _initial_radius(k, limit):
+    # k が小さいほど狭い範囲から探し始める（KNN_INITIAL_K 件で KNN_INITIAL_RADIUS_M）
+    radius = KNN_INITIAL_RADIUS_M * math.sqrt(k / KNN_INITIAL_K)
+    return min(max(radius, KNN_MIN_RADIUS_M), limit)
+
+
+def _exact_distance(lat, lng, row, columns, approximate):
+    # 取得した行の緯度経度で距離を計算し直す（数値でなければ索引上の距離を使う）
+    row_lat = to_number(row[columns['latitude']])
+    row_lng = to_number(row[columns['longitude']])
+    if row_lat is None or row_lng is None:
+        return approximate
+    return haversine(lat, lng, row_lat, row_lng)
+
+
+def nearby_restaurants(filters, lat, lng, radius=None, k=None, fields=None):
+    # (lat, lng) から近い順に (列名, [(距離, 行), ...]) を返す
+    # radius のみ: 半径内すべて、k のみ: 近い k 件、両方: 半径内の近い k 件
+    # fields を指定した場合はその列だけを読む（id を含めること）
+    with get_connection() as conn:
+        if k is None:
+            limit = radius or DEFAULT_RADIUS_M
+            candidates = _candidates(conn, filters, lat, lng, limit)
+        else:
+            # 円内に確実に k 件以上あるとわかるまで探索範囲を広げる
+            # 見つかった件数から密度を見積もり、k 件が入りそうな半径まで一度に広げる
+            limit = radius or KNN_MAX_RADIUS_M
+            search_radius = _initial_radius(k, limit)
+            # 密集した場所では、矩形内の件数が k 件の数倍程度になるまで最初の半径を縮める
+            while search_radius > KNN_MIN_RADIUS_M:
+                count = _count(conn, filters, lat, lng, search_radius)
+                if count <= KNN_MAX_CANDIDATES * k:
+                    break
+                search_radius = max(search_radius * math.sqrt(2 * k / count), KNN_MIN_RADIUS_M)
+            while True:
+                candidates = _candidates(conn, filters, lat, lng, search_radius)
+                inside = sum(1 for distance, _ in candidates if distance <= search_radius - RTREE_TOLERANCE_M)
+                if inside >= k or search_radius >= limit:
+                    break
+                factor = 1.2 * math.sqrt(k / inside) if inside else 2
+                search_radius = min(search_radius * factor, limit)
+
+            # おおよその距離で k 番目に近い候補から誤差の範囲内のものだけを残す
+            candidates.sort()
+            if len(candidates) > k:
+                cutoff = candidates[k - 1][0] + 2 * RTREE_TOLERANCE_M
+                candidates = [candidate for candidate in candidates if candidate[0] <= cutoff]
+
+        # 正確な距離の計算に使う緯度経度は、指定された列に無くても読み込む
+        selected = list(fields or ())
+        selected += [name for name in ('latitude', 'longitude') if fields and name not in fields]
+        with timed('query', 'fetch rows'):
+            column_names, rows = fetch_rows(conn, [id for _, id in candidates], ', '.join(selected) or '*')
+    columns = {name: i for i, name in enumerate(column_names)}
+    results = []
+    for approximate, id in candidates:
+        row = rows.get(id)
+        if row is None:
+            continue
+        distance = _exact_distance(lat, lng, row, columns, approximate)
+        if distance <= limit:
+            results.append((distance, id, row))
+    results.sort(key=lambda result: result[:2])
+    if k is not None:
+        results = results[:k]
+    if fields:
+        width = len(fields)
+        return list(fields), [(distance, row[:width]) for distance, _, row in results]
+    return column_names, [(distance, row) for distance, _, row in results]
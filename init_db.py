@@ -1,15 +1,179 @@
-import sqlite3
+import argparse
 
-def init_db():
-    conn = sqlite3.connect('example.db')
-    c = conn.cursor()
+from db import DATABASE_PATH, connect
+from payloads import create_payload_table, refresh_payloads
 
-    # 既存のテーブルを削除
-    c.execute('DROP TABLE IF EXISTS restaurants')
+# 並び替え用の総合スコア: 食べログと Google の評価を口コミ件数で重み付けした平均
+# 口コミの少ない店舗は SCORE_PRIOR_RATING に寄せる（件数 SCORE_PRIOR_REVIEWS 件分）
+# 式インデックスとして事前計算されるため、クエリでも同じ式をそのまま使うこと
+SCORE_PRIOR_RATING = 3.5
+SCORE_PRIOR_REVIEWS = 50
+SCORE_EXPRESSION = (
+    '(COALESCE(tabelog_rating * tabelog_reviews, 0)'
+    ' + COALESCE(google_rating * google_reviews, 0)'
+    f' + {SCORE_PRIOR_RATING * SCORE_PRIOR_REVIEWS})'
+    ' / (COALESCE(tabelog_reviews * (tabelog_rating IS NOT NULL), 0)'
+    ' + COALESCE(google_reviews * (google_rating IS NOT NULL), 0)'
+    f' + {SCORE_PRIOR_REVIEWS})'
+)
 
-    # 新しいテーブルを作成（29列に対応）
+# 検索フォームから送られるフィルタの組み合わせに合わせた複合インデックス
+# （後半は並び替え用: ORDER BY ... LIMIT k をソートせずにインデックス順で読み出す）
+INDEXES = {
+    'idx_restaurants_area_capacity': 'restaurants(area, capacity)',
+    'idx_restaurants_area_budget': 'restaurants(area, budget_min, budget_max)',
+    'idx_restaurants_area_flags': 'restaurants(area, has_private_room, has_drink_all_included, capacity)',
+    'idx_restaurants_capacity': 'restaurants(capacity)',
+    'idx_restaurants_budget': 'restaurants(budget_min, budget_max)',
+    'idx_restaurants_flags': 'restaurants(has_private_room, has_drink_all_included, capacity)',
+    'idx_restaurants_category': 'restaurants(category)',
+    'idx_restaurants_score': f'restaurants(({SCORE_EXPRESSION}) DESC)',
+    'idx_restaurants_area_score': f'restaurants(area, ({SCORE_EXPRESSION}) DESC)',
+    'idx_restaurants_tabelog_rating': 'restaurants(tabelog_rating DESC)',
+    'idx_restaurants_google_rating': 'restaurants(google_rating DESC)',
+    'idx_restaurants_budget_rank': 'restaurants(budget_min IS NULL, budget_min, budget_max)',
+    # エリア指定と並び替え（search.SORT_ORDERS）の組み合わせ。末尾の id は rowid として索引に含まれる
+    'idx_restaurants_area_tabelog_rating': 'restaurants(area, tabelog_rating DESC)',
+    'idx_restaurants_area_google_rating': 'restaurants(area, google_rating DESC)',
+    'idx_restaurants_area_budget_rank': 'restaurants(area, budget_min IS NULL, budget_min, budget_max)',
+}
+
+# 変更履歴（restaurant_changes）に残す件数の上限。これより古い履歴は load_data.py が削除する
+CHANGE_LOG_LIMIT = 100000
+
+def create_indexes(c):
+    for name, target in INDEXES.items():
+        c.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {target}')
+
+def create_search_tables(c):
+    # ジャンル検索用の全文検索テーブル（trigram で部分一致を索引化）
+    c.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS restaurants_fts USING fts5(
+            category,
+            content='restaurants',
+            content_rowid='id',
+            tokenize='trigram'
+        )
+    ''')
+    # restaurants の変更を全文検索テーブルへ反映するトリガー
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS restaurants_fts_ai AFTER INSERT ON restaurants BEGIN
+            INSERT INTO restaurants_fts(rowid, category) VALUES (new.id, new.category);
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS restaurants_fts_ad AFTER DELETE ON restaurants BEGIN
+            INSERT INTO restaurants_fts(restaurants_fts, rowid, category)
+            VALUES ('delete', old.id, old.category);
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS restaurants_fts_au AFTER UPDATE OF id, category ON restaurants BEGIN
+            INSERT INTO restaurants_fts(restaurants_fts, rowid, category)
+            VALUES ('delete', old.id, old.category);
+            INSERT INTO restaurants_fts(rowid, category) VALUES (new.id, new.category);
+        END
+    ''')
+    # 短いジャンル文字列用に、カテゴリ文字列の一覧を別テーブルで持つ
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS restaurant_categories (
+            category TEXT PRIMARY KEY
+        ) WITHOUT ROWID
+    ''')
+    # INSERT OR IGNORE は外側の文（UPSERT の ON CONFLICT など）の競合処理で上書きされるため、
+    # 既にあるかどうかを確かめてから追加する（古い定義のトリガーは作り直す）
+    for name, event in (('restaurant_categories_ai', 'INSERT'),
+                        ('restaurant_categories_au', 'UPDATE OF category')):
+        c.execute(f'DROP TRIGGER IF EXISTS {name}')
+        c.execute(f'''
+            CREATE TRIGGER {name} AFTER {event} ON restaurants
+            WHEN new.category IS NOT NULL BEGIN
+                INSERT INTO restaurant_categories(category)
+                SELECT new.category WHERE NOT EXISTS (
+                    SELECT 1 FROM restaurant_categories WHERE category = new.category
+                );
+            END
+        ''')
+    # 既存データがあれば索引を作り直す
+    c.execute("INSERT INTO restaurants_fts(restaurants_fts) VALUES ('rebuild')")
+    c.execute('DELETE FROM restaurant_categories')
+    c.execute('''
+        INSERT INTO restaurant_categories(category)
+        SELECT DISTINCT category FROM restaurants WHERE category IS NOT NULL
+    ''')
+
+def create_spatial_index(c):
+    # 緯度経度の R*Tree 空間インデックス（近隣検索用）
+    # 1件ずつ削除するより作り直す方が速いため、既存の索引は破棄する
+    c.execute('DROP TABLE IF EXISTS restaurants_rtree')
+    c.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS restaurants_rtree USING rtree(
+            id, min_lat, max_lat, min_lng, max_lng
+        )
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS restaurants_rtree_ai AFTER INSERT ON restaurants
+        WHEN new.latitude IS NOT NULL AND new.longitude IS NOT NULL BEGIN
+            INSERT INTO restaurants_rtree VALUES
+                (new.id, new.latitude, new.latitude, new.longitude, new.longitude);
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS restaurants_rtree_ad AFTER DELETE ON restaurants BEGIN
+            DELETE FROM restaurants_rtree WHERE id = old.id;
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS restaurants_rtree_au AFTER UPDATE OF id, latitude, longitude ON restaurants BEGIN
+            DELETE FROM restaurants_rtree WHERE id = old.id;
+            INSERT INTO restaurants_rtree
+            SELECT new.id, new.latitude, new.latitude, new.longitude, new.longitude
+            WHERE new.latitude IS NOT NULL AND new.longitude IS NOT NULL;
+        END
+    ''')
+    # 既存データがあれば索引を作り直す
+    c.execute('''
+        INSERT INTO restaurants_rtree
+        SELECT id, latitude, latitude, longitude, longitude FROM restaurants
+        WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+    ''')
+
+def create_change_log(c):
+    # 変更された店舗 id の履歴（ファセット集計を差分で更新するために使う）
     c.execute('''
-        CREATE TABLE IF NOT EXISTS restaurants (
+        CREATE TABLE IF NOT EXISTS restaurant_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            restaurant_id INTEGER
+        )
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS restaurant_changes_ai AFTER INSERT ON restaurants BEGIN
+            INSERT INTO restaurant_changes(restaurant_id) VALUES (new.id);
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS restaurant_changes_au AFTER UPDATE ON restaurants BEGIN
+            INSERT INTO restaurant_changes(restaurant_id) VALUES (old.id);
+            INSERT INTO restaurant_changes(restaurant_id) SELECT new.id WHERE new.id != old.id;
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS restaurant_changes_ad AFTER DELETE ON restaurants BEGIN
+            INSERT INTO restaurant_changes(restaurant_id) VALUES (old.id);
+        END
+    ''')
+    # restaurant_id が NULL の行は「全件を読み直す」印（テーブルの作り直し・入れ替え時）
+    c.execute('INSERT INTO restaurant_changes(restaurant_id) VALUES (NULL)')
+
+def prune_change_log(c, limit=CHANGE_LOG_LIMIT):
+    c.execute('''
+        DELETE FROM restaurant_changes
+        WHERE seq <= (SELECT MAX(seq) FROM restaurant_changes) - ?
+    ''', (limit,))
+
+def create_restaurants_table(c, table='restaurants'):
+    c.execute(f'''
+        CREATE TABLE IF NOT EXISTS {table} (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             name TEXT,
             address TEXT,
@@ -42,14 +206,50 @@ def init_db():
             detail_image3 TEXT
         )
     ''')
+
+def create_derived_objects(c):
+    # restaurants に付随するインデックス・検索用テーブル・トリガーをまとめて作成（再構築）する
+    create_indexes(c)
+    create_search_tables(c)
+    create_spatial_index(c)
+    create_change_log(c)
+    # 詳細のレスポンスを事前生成しておく（全件作り直すので、古い形式のテーブルも置き換える）
+    c.execute('DROP TABLE IF EXISTS restaurant_payloads')
+    create_payload_table(c)
+    refresh_payloads(c, rebuild=True)
+
+def migrate_db(path=None):
+    # 既存データを残したままインデックスと検索用テーブルだけを追加する
+    conn = connect(path)
+    c = conn.cursor()
+    create_derived_objects(c)
+    c.execute('ANALYZE')
+    conn.commit()
+    conn.close()
+
+def init_db(path=None):
+    conn = connect(path)
+    c = conn.cursor()
+
+    # 既存のテーブルを削除
+    c.execute('DROP TABLE IF EXISTS restaurants_fts')
+    c.execute('DROP TABLE IF EXISTS restaurant_categories')
+    c.execute('DROP TABLE IF EXISTS restaurants_rtree')
+    c.execute('DROP TABLE IF EXISTS restaurant_payloads')
+    c.execute('DROP TABLE IF EXISTS restaurant_changes')
+    c.execute('DROP TABLE IF EXISTS restaurants')
+
+    # 新しいテーブルを作成（29列に対応）
+    create_restaurants_table(c)
+    create_derived_objects(c)
     conn.commit()
     conn.close()
 
     # テーブルが正しく作成されたか確認（オプション）
-    check_db()
+    check_db(path)
 
-def check_db():
-    conn = sqlite3.connect('example.db')
+def check_db(path=None):
+    conn = connect(path)
     c = conn.cursor()
 
     # テーブルの存在確認
@@ -59,5 +259,19 @@ def check_db():
     
     conn.close()
 
-# 実行してデータベースを作成
-init_db()
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='restaurants テーブルとインデックス・検索用テーブルを作成する')
+    parser.add_argument('--migrate', action='store_true',
+                        help='既存データを残したままインデックスと検索用テーブルだけを追加する')
+    parser.add_argument('--database', default=DATABASE_PATH)
+    args = parser.parse_args(argv)
+
+    if args.migrate:
+        migrate_db(args.database)
+        check_db(args.database)
+    else:
+        init_db(args.database)
+
+# 実行してデータベースを作成（--migrate の場合は既存データを残してインデックスのみ追加）
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+import argparse
+import csv
+import json
+import sys
+import time
+from itertools import islice
+
+from db import DATABASE_PATH, connect
+from init_db import create_derived_objects, create_restaurants_table, prune_change_log
+from payloads import refresh_payloads
+
+# 全件入れ替え時にデータを流し込む影テーブル
+SHADOW_TABLE = 'restaurants_new'
+DEFAULT_BATCH_SIZE = 5000
+# 差分ロードで行を削除する場合に立てるフィールド
+DELETE_FIELD = '_delete'
+
+
+def read_csv(path):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for record in csv.DictReader(f):
+            # CSV の空文字は NULL として扱う
+            yield {key: (value if value != '' else None) for key, value in record.items()}
+
+
+def read_jsonl(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def read_records(path, input_format=None):
+    # 拡張子（または --format）に応じて1行ずつ読み出す
+    input_format = input_format or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+    if input_format == 'jsonl':
+        return read_jsonl(path)
+    return read_csv(path)
+
+
+def batched(records, size):
+    iterator = iter(records)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def table_columns(conn, table):
+    return [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+
+
+def _value(value):
+    # メニューなどのリスト・辞書は JSON 文字列として保存する
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+# 削除フラグとして受け付ける値（文字列は大文字小文字を区別しない）
+DELETE_TRUE = ('1', 'true', 'yes')
+DELETE_FALSE = ('', '0', 'false', 'no')
+
+
+def _is_deleted(record):
+    # 解釈できない値は削除とみなさずにエラーにする（'False' などで行を消さないため）
+    value = record.get(DELETE_FIELD)
+    if value is None or value is False or value is True:
+        return bool(value)
+    if type(value) is int and value in (0, 1):
+        return value == 1
+    if isinstance(value, str):
+        text = value.strip().lower()
+        if text in DELETE_TRUE:
+            return True
+        if text in DELETE_FALSE:
+            return False
+    raise ValueError(f'invalid {DELETE_FIELD} value: {value!r}')
+
+
+class _Writer:
+    """レコードを列の組み合わせごとにまとめて executemany で書き込む。"""
+
+    def __init__(self, conn, table, key=None):
+        self.conn = conn
+        self.table = table
+        self.key = key
+        self.columns = set(table_columns(conn, table))
+        self.ignored = set()
+        self.written = 0
+        self.deleted = 0
+
+    def _statement(self, columns):
+        names = ', '.join(columns)
+        placeholders = ', '.join('?' * len(columns))
+        sql = f'INSERT INTO {self.table} ({names}) VALUES ({placeholders})'
+        if self.key in columns:
+            updates = [f'{name} = excluded.{name}' for name in columns if name != self.key]
+            action = f"DO UPDATE SET {', '.join(updates)}" if updates else 'DO NOTHING'
+            sql += f' ON CONFLICT({self.key}) {action}'
+        return sql
+
+    def write(self, batch):
+        groups = {}
+        deletes = []
+        for record in batch:
+            if self.key and _is_deleted(record):
+                deletes.append((_value(record.get(self.key)),))
+                continue
+            columns = []
+            for name in record:
+                if name in self.columns:
+                    columns.append(name)
+                elif name != DELETE_FIELD and name not in self.ignored:
+                    self.ignored.add(name)
+                    print(f"Ignoring unknown column: {name}", file=sys.stderr)
+            columns = tuple(columns)
+            groups.setdefault(columns, []).append(tuple(_value(record[name]) for name in columns))
+
+        for columns, rows in groups.items():
+            self.conn.executemany(self._statement(columns), rows)
+            self.written += len(rows)
+        if deletes:
+            cursor = self.conn.executemany(
+                f'DELETE FROM {self.table} WHERE {self.key} = ?', deletes
+            )
+            self.deleted += cursor.rowcount
+
+
+def require_key_index(conn, key):
+    # id 以外をキーにする場合は ON CONFLICT のために既存の一意インデックスが必要
+    # （ここで作ると重複した値の追加ができなくなり、replace で黙って消えるため作らない）
+    if key == 'id':
+        return
+    for _, name, unique, *_ in conn.execute('PRAGMA index_list(restaurants)').fetchall():
+        columns = [row[2] for row in conn.execute(f'PRAGMA index_info("{name}")')]
+        if unique and columns == [key]:
+            return
+    raise ValueError(f'key column {key} needs a unique index on restaurants({key})')
+
+
+def upsert_records(conn, records, key='id', batch_size=DEFAULT_BATCH_SIZE):
+    # 差分ロード: バッチごとにトランザクションを分けて upsert / 削除する
+    if key not in table_columns(conn, 'restaurants'):
+        raise ValueError(f'unknown key column: {key}')
+    require_key_index(conn, key)
+    writer = _Writer(conn, 'restaurants', key)
+    for batch in batched(records, batch_size):
+        with conn:
+            writer.write(batch)
+    # 変更された行の詳細・メニューを事前生成し直す
+    with conn:
+        refresh_payloads(conn)
+        prune_change_log(conn)
+    return writer
+
+
+def replace_records(conn, records, batch_size=DEFAULT_BATCH_SIZE):
+    # 全件入れ替え: 影テーブルに読み込んでから1トランザクションで差し替える
+    # WAL モードのため、差し替えが終わるまで読み取り側は旧テーブルを参照し続けられる
+    conn.execute(f'DROP TABLE IF EXISTS {SHADOW_TABLE}')
+    create_restaurants_table(conn, SHADOW_TABLE)
+    conn.commit()
+
+    writer = _Writer(conn, SHADOW_TABLE, key='id')
+    for batch in batched(records, batch_size):
+        with conn:
+            writer.write(batch)
+
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute('DROP TABLE IF EXISTS restaurants')
+        conn.execute(f'ALTER TABLE {SHADOW_TABLE} RENAME TO restaurants')
+        create_derived_objects(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    conn.execute('PRAGMA optimize')
+    return writer
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='restaurants テーブルへ CSV / JSONL を一括ロードする')
+    parser.add_argument('path', help='入力ファイル（.csv / .jsonl）')
+    parser.add_argument('--format', choices=('csv', 'jsonl'), help='入力形式（省略時は拡張子から判定）')
+    parser.add_argument('--mode', choices=('upsert', 'replace'), default='upsert',
+                        help='upsert: キーで差分ロード / replace: 影テーブル経由で全件入れ替え')
+    parser.add_argument('--key', default='id', help='upsert の一意キー列（既定: id。id 以外は一意インデックスが必要）')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--database', default=DATABASE_PATH)
+    args = parser.parse_args(argv)
+    if args.mode == 'replace' and args.key != 'id':
+        parser.error('--key は upsert でのみ指定できます')
+
+    conn = connect(args.database)
+    start = time.perf_counter()
+    records = read_records(args.path, args.format)
+    try:
+        if args.mode == 'replace':
+            writer = replace_records(conn, records, args.batch_size)
+        else:
+            writer = upsert_records(conn, records, args.key, args.batch_size)
+    finally:
+        conn.close()
+    elapsed = time.perf_counter() - start
+    print(f"Loaded {writer.written} rows, deleted {writer.deleted} rows in {elapsed:.2f}s ({args.mode})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+
+# 計測の設定（環境変数で上書き可能）
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 200))
+SLOW_QUERY_SAMPLE_RATE = float(os.environ.get('SLOW_QUERY_SAMPLE_RATE', 0.1))
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '1') not in ('0', 'false')
+
+# レイテンシのヒストグラムのバケット（秒）
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+logger = logging.getLogger('metrics')
+
+
+class _Histogram:
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.total += value
+        self.count += 1
+
+
+class Registry:
+    """エンドポイントごとのレイテンシ・フェーズ時間・返却件数を集計する。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = {}
+        self.phases = {}
+        self.requests = {}
+        self.rows = {}
+
+    def observe_request(self, endpoint, method, status, duration, timings):
+        with self._lock:
+            key = (endpoint, method)
+            histogram = self.latency.get(key)
+            if histogram is None:
+                histogram = self.latency[key] = _Histogram()
+            histogram.observe(duration)
+            status_key = (endpoint, method, status)
+            self.requests[status_key] = self.requests.get(status_key, 0) + 1
+            for phase, seconds in timings.items():
+                phase_key = (endpoint, phase)
+                histogram = self.phases.get(phase_key)
+                if histogram is None:
+                    histogram = self.phases[phase_key] = _Histogram()
+                histogram.observe(seconds)
+
+    def add_rows(self, endpoint, count):
+        with self._lock:
+            self.rows[endpoint] = self.rows.get(endpoint, 0) + count
+
+    def render(self, gauges=()):
+        # Prometheus のテキスト形式で出力する
+        lines = []
+        with self._lock:
+            lines += _render_histograms(
+                'http_request_duration_seconds', 'Request latency by endpoint.',
+                ('endpoint', 'method'), self.latency,
+            )
+            lines += _render_histograms(
+                'http_request_phase_seconds', 'Time spent in each request phase.',
+                ('endpoint', 'phase'), self.phases,
+            )
+            lines.append('# HELP http_requests_total Requests by endpoint and status.')
+            lines.append('# TYPE http_requests_total counter')
+            for (endpoint, method, status), value in sorted(self.requests.items()):
+                labels = _labels(endpoint=endpoint, method=method, status=status)
+                lines.append(f'http_requests_total{labels} {value}')
+            lines.append('# HELP restaurants_rows_returned_total Rows returned by endpoint.')
+            lines.append('# TYPE restaurants_rows_returned_total counter')
+            for endpoint, value in sorted(self.rows.items()):
+                lines.append(f'restaurants_rows_returned_total{_labels(endpoint=endpoint)} {value}')
+        for name, help_text, values in gauges:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            for labels, value in values:
+                lines.append(f'{name}{_labels(**labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+def _render_histograms(name, help_text, label_names, histograms):
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+    for key, histogram in sorted(histograms.items()):
+        labels = dict(zip(label_names, key))
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, histogram.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{_labels(**labels, le=bound)} {cumulative}')
+        lines.append(f'{name}_bucket{_labels(**labels, le="+Inf")} {histogram.count}')
+        lines.append(f'{name}_sum{_labels(**labels)} {histogram.total:.6f}')
+        lines.append(f'{name}_count{_labels(**labels)} {histogram.count}')
+    return lines
+
+
+registry = Registry()
+
+
+def _endpoint():
+    rule = request.url_rule
+    return rule.rule if rule is not None else 'unmatched'
+
+
+@contextmanager
+def timed(phase, detail=None):
+    # リクエスト内の処理時間をフェーズ（parse / query / serialize）ごとに記録する
+    # query フェーズが SLOW_QUERY_MS を超えた場合はサンプリングしてログに残す
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if has_request_context():
+            timings = g.setdefault('timings', {})
+            timings[phase] = timings.get(phase, 0.0) + elapsed
+        if (phase == 'query' and elapsed * 1000 >= SLOW_QUERY_MS
+                and random.random() < SLOW_QUERY_SAMPLE_RATE):
+            logger.warning("遅いクエリ (%.1f ms): %s", elapsed * 1000, detail)
+
+
+def add_rows(count):
+    # 現在のリクエストで返却した件数を加算する（ストリーミング中も呼び出し可）
+    if has_request_context():
+        g.rows = g.get('rows', 0) + count
+        registry.add_rows(_endpoint(), count)
+
+
+def request_rows():
+    # 現在のリクエストでこれまでに加算した件数（キャッシュしたレスポンスの件数を求めるために使う）
+    return g.get('rows', 0) if has_request_context() else 0
+
+
+def init_app(app):
+    @app.before_request
+    def _start_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def _record_timing(response):
+        start = g.pop('request_start', None)
+        if start is None:
+            return response
+        duration = time.perf_counter() - start
+        timings = g.get('timings', {})
+        registry.observe_request(
+            _endpoint(), request.method, response.status_code, duration, timings
+        )
+        if SERVER_TIMING:
+            entries = [f'{phase};dur={seconds * 1000:.2f}' for phase, seconds in timings.items()]
+            entries.append(f'total;dur={duration * 1000:.2f}')
+            response.headers['Server-Timing'] = ', '.join(entries)
+        return response
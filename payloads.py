@@ -0,0 +1,162 @@
+import json
+import os
+
+# 詳細・メニューのレスポンスを事前に JSON バイト列として作っておく（restaurant_payloads テーブル）
+# JSON_SERIALIZER=orjson で orjson を使用（未インストールの場合は標準の json）
+JSON_SERIALIZER = os.environ.get('JSON_SERIALIZER', 'json')
+REFRESH_BATCH_SIZE = 2000
+# IN (...) に渡すパラメータ数の上限（古い SQLite の既定値 999 未満に抑える）
+IN_CHUNK_SIZE = 900
+# JSON レスポンスの Content-Type（日本語はエスケープせず UTF-8 のまま返す）
+JSON_MIMETYPE = 'application/json; charset=utf-8'
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# /restaurant/<id> のキー名と restaurants の列名の対応
+DETAIL_FIELDS = (
+    ('id', 'id'),
+    ('name', 'name'),
+    ('address', 'address'),
+    ('phone_number', 'phone'),
+    ('tabelog_rating', 'tabelog_rating'),
+    ('tabelog_review_count', 'tabelog_reviews'),
+    ('tabelog_link', 'tabelog_link'),
+    ('google_rating', 'google_rating'),
+    ('google_review_count', 'google_reviews'),
+    ('google_link', 'google_link'),
+    ('opening_hours', 'opening_hours'),
+    ('course', 'course'),
+    ('menu', 'menu'),
+    ('drink_menu', 'drink_menu'),
+    ('store_top_image', 'store_top_image'),
+    ('description', 'description'),
+    ('longitude', 'longitude'),
+    ('latitude', 'latitude'),
+    ('area', 'area'),
+    ('nearest_station', 'nearest_station'),
+    ('directions', 'directions'),
+    ('capacity', 'capacity'),
+    ('category', 'category'),
+    ('budget_min', 'budget_min'),
+    ('budget_max', 'budget_max'),
+    ('has_private_room', 'has_private_room'),
+    ('has_drink_all_included', 'has_drink_all_included'),
+    ('detail_image1', 'detail_image1'),
+    ('detail_image2', 'detail_image2'),
+    ('detail_image3', 'detail_image3'),
+)
+DETAIL_KEYS = tuple(key for key, _ in DETAIL_FIELDS)
+DETAIL_COLUMNS = ', '.join(column for _, column in DETAIL_FIELDS)
+
+
+def dumps(obj):
+    # jsonify と同じ形式（キー順・UTF-8・区切り・末尾改行）のバイト列
+    # app.py は jsonify も ensure_ascii=False にしているため、標準の json ではバイト列まで一致する
+    if JSON_SERIALIZER == 'orjson' and orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS | orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(obj, ensure_ascii=False, sort_keys=True, separators=(',', ':')) + '\n').encode()
+
+
+def parse_menus(food_menu, drink_menu):
+    # JSON文字列で保存されている場合
+    try:
+        food_menu = json.loads(food_menu) if food_menu else []
+        drink_menu = json.loads(drink_menu) if drink_menu else []
+    except json.JSONDecodeError:
+        # カンマ区切りの場合
+        food_menu = food_menu.split(",") if food_menu else []
+        drink_menu = drink_menu.split(",") if drink_menu else []
+    return food_menu, drink_menu
+
+
+def build_detail(row):
+    # DETAIL_COLUMNS の順で取得した行から詳細レスポンスを作る
+    return dict(zip(DETAIL_KEYS, row))
+
+
+def build_menu(row):
+    return menu_details(row[DETAIL_KEYS.index('menu')], row[DETAIL_KEYS.index('drink_menu')])
+
+
+def menu_details(food_menu, drink_menu):
+    food_menu, drink_menu = parse_menus(food_menu, drink_menu)
+    return {"foodMenu": food_menu, "drinkMenu": drink_menu}
+
+
+def create_payload_table(c):
+    # メニューは詳細にも同じ文字列が含まれるため事前生成せず、リクエスト時に2列だけ読んで作る
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS restaurant_payloads (
+            id INTEGER PRIMARY KEY,
+            detail BLOB NOT NULL
+        )
+    ''')
+    # 元の行が変わったら事前生成した内容を破棄する（refresh_payloads で作り直す）
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS restaurant_payloads_au AFTER UPDATE ON restaurants BEGIN
+            DELETE FROM restaurant_payloads WHERE id IN (old.id, new.id);
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS restaurant_payloads_ad AFTER DELETE ON restaurants BEGIN
+            DELETE FROM restaurant_payloads WHERE id = old.id;
+        END
+    ''')
+
+
+def refresh_payloads(c, rebuild=False):
+    # 事前生成が無い（または破棄された）行の詳細を作成する
+    if rebuild:
+        c.execute('DELETE FROM restaurant_payloads')
+    c.execute('DELETE FROM restaurant_payloads WHERE id NOT IN (SELECT id FROM restaurants)')
+    last_id = float('-inf')
+    refreshed = 0
+    while True:
+        rows = c.execute(f'''
+            SELECT {DETAIL_COLUMNS} FROM restaurants
+            WHERE id > ? AND id NOT IN (SELECT id FROM restaurant_payloads)
+            ORDER BY id LIMIT ?
+        ''', (last_id, REFRESH_BATCH_SIZE)).fetchall()
+        if not rows:
+            return refreshed
+        payloads = [(row[0], dumps(build_detail(row))) for row in rows]
+        c.executemany(
+            'INSERT OR REPLACE INTO restaurant_payloads (id, detail) VALUES (?, ?)',
+            payloads,
+        )
+        refreshed += len(payloads)
+        last_id = rows[-1][0]
+
+
+def get_payload(conn, id, kind, has_table=True):
+    # kind は 'detail' または 'menu'。該当する店舗が無い場合は None
+    if kind == 'menu':
+        row = conn.execute('SELECT menu, drink_menu FROM restaurants WHERE id = ?', (id,)).fetchone()
+        return None if row is None else dumps(menu_details(*row))
+    if has_table:
+        row = conn.execute('SELECT detail FROM restaurant_payloads WHERE id = ?', (id,)).fetchone()
+        if row is not None:
+            return row[0]
+    row = conn.execute(
+        f'SELECT {DETAIL_COLUMNS} FROM restaurants WHERE id = ?', (id,)
+    ).fetchone()
+    if row is None:
+        return None
+    return dumps(build_detail(row))
+
+
+def fetch_detail_rows(conn, ids):
+    # 複数の id をまとめて取得し {id: 行} を返す（パラメータ上限に合わせて分割）
+    unique_ids = list(dict.fromkeys(ids))
+    rows = {}
+    for start in range(0, len(unique_ids), IN_CHUNK_SIZE):
+        chunk = unique_ids[start:start + IN_CHUNK_SIZE]
+        placeholders = ', '.join('?' * len(chunk))
+        for row in conn.execute(
+            f'SELECT {DETAIL_COLUMNS} FROM restaurants WHERE id IN ({placeholders})', chunk
+        ):
+            rows[row[0]] = row
+    return rows
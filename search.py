@@ -0,0 +1,290 @@
+import logging
+import os
+from urllib.parse import unquote
+
+from db import get_connection, get_dedicated_connection
+from init_db import SCORE_EXPRESSION
+from metrics import timed
+from payloads import IN_CHUNK_SIZE
+
+# 検索の実行方式: 'sql'（既定）または 'columnar'（numpy によるメモリ内検索）
+SEARCH_ENGINE = os.environ.get('SEARCH_ENGINE', 'sql')
+
+# trigram 全文検索が使えるジャンル文字列の最小長
+FTS_MIN_LENGTH = 3
+
+FLAG_VALUES = ('有', '無')
+
+# ページングの既定値と上限、ストリーミング時に一度に読み込む行数
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 1000))
+STREAM_CHUNK_SIZE = int(os.environ.get('STREAM_CHUNK_SIZE', 500))
+RESPONSE_FORMATS = ('json', 'ndjson')
+
+# ?sort= の並び順（同順位は id 順）。distance は geo.py の近隣検索で処理する
+SORT_ORDERS = {
+    'score': f'({SCORE_EXPRESSION}) DESC, id',
+    'tabelog_rating': 'tabelog_rating DESC, id',
+    'google_rating': 'google_rating DESC, id',
+    'budget': 'budget_min IS NULL, budget_min, budget_max, id',
+}
+SORT_KEYS = tuple(SORT_ORDERS) + ('distance',)
+
+_search_tables = set()
+_columns = None
+_engine = None
+
+
+def parse_results_filters(payload):
+    # /results のリクエストボディを正規化したフィルタ辞書に変換する
+    payload = payload or {}
+    private_room = unquote(payload.get('privateRoom', '').strip()) or None
+    drink_included = unquote(payload.get('drinkIncluded', '').strip()) or None
+    return {
+        'area': unquote(payload.get('area', '').strip()) or None,
+        'genre': unquote(payload.get('genre', '').strip()) or None,
+        'guests': payload.get('guests', 0) or None,
+        'budget_min': payload.get('budgetMin', None) or None,
+        'budget_max': payload.get('budgetMax', None) or None,
+        'private_room': private_room if private_room in FLAG_VALUES else None,
+        'drink_included': drink_included if drink_included in FLAG_VALUES else None,
+    }
+
+
+def parse_restaurants_filters(payload):
+    # /api/restaurants (POST) のリクエストボディを正規化したフィルタ辞書に変換する
+    payload = payload or {}
+    return {
+        'area': payload.get('area', '') or None,
+        'genre': payload.get('genre', '') or None,
+        'guests': payload.get('people', 0) or None,
+        'budget_min': None,
+        'budget_max': None,
+        'private_room': None,
+        'drink_included': None,
+    }
+
+
+def parse_fields(args):
+    # ?fields=（カンマ区切りの列名）を解釈する（指定が無ければ None、不明な列は ValueError）
+    if not args.get('fields'):
+        return None
+    fields = [name.strip() for name in args['fields'].split(',') if name.strip()]
+    unknown = [name for name in fields if name not in get_columns()]
+    if unknown:
+        raise ValueError(f"unknown fields: {', '.join(unknown)}")
+    # カーソルや結果の識別に使うため id は常に含める
+    if 'id' not in fields:
+        fields.insert(0, 'id')
+    return fields
+
+
+def parse_list_options(args):
+    # ページング・射影・ストリーミングのクエリパラメータを解釈する（不正な値は ValueError）
+    fields = parse_fields(args)
+
+    after = None
+    if args.get('cursor'):
+        try:
+            after = int(args['cursor'])
+        except ValueError:
+            raise ValueError('cursor must be an integer') from None
+
+    limit = None
+    if args.get('limit'):
+        try:
+            limit = int(args['limit'])
+        except ValueError:
+            raise ValueError('limit must be an integer') from None
+        if not 0 < limit <= MAX_PAGE_SIZE:
+            raise ValueError(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+
+    response_format = args.get('format', 'json')
+    if response_format not in RESPONSE_FORMATS:
+        raise ValueError(f"format must be one of: {', '.join(RESPONSE_FORMATS)}")
+    stream = response_format == 'ndjson' or args.get('stream') in ('1', 'true')
+
+    # 並び替え（limit と組み合わせると上位 k 件だけを取り出す）
+    sort = args.get('sort') or None
+    origin = None
+    if sort is not None:
+        if sort not in SORT_KEYS:
+            raise ValueError(f"sort must be one of: {', '.join(SORT_KEYS)}")
+        if after is not None:
+            raise ValueError('cursor cannot be combined with sort')
+        if sort == 'distance':
+            try:
+                origin = (float(args['lat']), float(args['lng']))
+            except (KeyError, ValueError):
+                raise ValueError('sort=distance requires numeric lat and lng') from None
+            if not (-90 <= origin[0] <= 90 and -180 <= origin[1] <= 180):
+                raise ValueError('lat/lng out of range')
+            if stream:
+                raise ValueError('sort=distance cannot be streamed')
+
+    return {
+        'fields': fields,
+        'after': after,
+        'limit': limit,
+        'format': response_format,
+        'stream': stream,
+        'sort': sort,
+        'origin': origin,
+    }
+
+
+def get_columns():
+    global _columns
+    if _columns is None:
+        with get_connection() as conn:
+            _columns = tuple(row[1] for row in conn.execute('PRAGMA table_info(restaurants)'))
+    return _columns
+
+
+def has_table(conn, name):
+    # init_db.py で作成される検索用テーブルの有無（作成済みと分かったものだけ覚えておく）
+    if name not in _search_tables:
+        row = conn.execute('SELECT 1 FROM sqlite_master WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            return False
+        _search_tables.add(name)
+    return True
+
+
+def _fts_phrase(genre):
+    return 'category : "' + genre.replace('"', '""') + '"'
+
+
+def build_where(conn, filters, ranked=False):
+    # フィルタ辞書から WHERE 句とパラメータを組み立てる
+    # ranked=True（並び替えあり）の場合は、並び替え用インデックスの順に読めるよう全文検索を使わない
+    clauses = []
+    params = []
+
+    if filters.get('area'):
+        clauses.append('area = ?')
+        params.append(filters['area'])
+    genre = filters.get('genre')
+    if genre:
+        # 3文字以上かつワイルドカードを含まない場合は全文検索インデックスを使う
+        fts = (not ranked and len(genre) >= FTS_MIN_LENGTH
+               and '%' not in genre and '_' not in genre)
+        if fts and has_table(conn, 'restaurants_fts'):
+            # trigram は ASCII 以外の大文字小文字も同一視するため、候補を LIKE で絞り直す
+            clauses.append('id IN (SELECT rowid FROM restaurants_fts WHERE restaurants_fts MATCH ?)'
+                           ' AND category LIKE ?')
+            params.extend([_fts_phrase(genre), f'%{genre}%'])
+        elif ranked and has_table(conn, 'restaurant_categories'):
+            # 一致するカテゴリ文字列を先に求めて値の一覧で渡す（一致が無ければ走査せずに0件）
+            categories = [row[0] for row in conn.execute(
+                'SELECT category FROM restaurant_categories WHERE category LIKE ? LIMIT ?',
+                (f'%{genre}%', IN_CHUNK_SIZE + 1),
+            )]
+            if len(categories) <= IN_CHUNK_SIZE:
+                clauses.append(f"category IN ({', '.join('?' * len(categories))})" if categories else '0')
+                params.extend(categories)
+            else:
+                clauses.append('category IN (SELECT category FROM restaurant_categories WHERE category LIKE ?)')
+                params.append(f'%{genre}%')
+        elif has_table(conn, 'restaurant_categories'):
+            # カテゴリ文字列の一覧から一致するものを探し、category インデックスで引く
+            clauses.append('category IN (SELECT category FROM restaurant_categories WHERE category LIKE ?)')
+            params.append(f'%{genre}%')
+        else:
+            clauses.append('category LIKE ?')
+            params.append(f'%{genre}%')
+    if filters.get('guests'):
+        clauses.append('capacity >= ?')
+        params.append(filters['guests'])
+    if filters.get('budget_min'):
+        clauses.append('budget_min >= ?')
+        params.append(filters['budget_min'])
+    if filters.get('budget_max'):
+        clauses.append('budget_max <= ?')
+        params.append(filters['budget_max'])
+    if filters.get('private_room'):
+        clauses.append('has_private_room = ?')
+        params.append(filters['private_room'])
+    if filters.get('drink_included'):
+        clauses.append('has_drink_all_included = ?')
+        params.append(filters['drink_included'])
+
+    where = ' AND '.join(clauses) if clauses else '1=1'
+    return where, params
+
+
+def build_search_query(conn, filters, columns='*', after=None, limit=None, sort=None):
+    where, params = build_where(conn, filters, ranked=sort is not None)
+    query = f'SELECT {columns} FROM restaurants WHERE {where}'
+    # ページングは id をキーにしたキーセット方式（OFFSET を使わない）
+    if after is not None:
+        query += ' AND id > ?'
+        params.append(after)
+    if sort is not None:
+        # 並び替え用のインデックス順に読み、LIMIT 件で打ち切る（全件のソートを避ける）
+        query += f' ORDER BY {SORT_ORDERS[sort]}'
+    elif after is not None or limit is not None:
+        query += ' ORDER BY id'
+    if limit is not None:
+        query += ' LIMIT ?'
+        params.append(limit)
+    return query, params
+
+
+def explain_search(conn, filters, limit=None, sort=None):
+    # 実行計画（EXPLAIN QUERY PLAN）の detail 列を返す
+    query, params = build_search_query(conn, filters, limit=limit, sort=sort)
+    return [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + query, params)]
+
+
+def get_engine():
+    # SEARCH_ENGINE=columnar の場合のみメモリ内検索エンジンを使う
+    global _engine
+    if _engine is None and SEARCH_ENGINE == 'columnar':
+        from engine import ColumnarEngine, np
+        if np is None:
+            logging.warning("numpy が見つからないため SQL 検索を使用します")
+            return None
+        _engine = ColumnarEngine()
+    return _engine
+
+
+def search_restaurants(filters, fields=None, after=None, limit=None, engine=None, sort=None):
+    # フィルタに一致する (列名, 行のリスト) を返す
+    # 並び順は sort があればその順、after か limit があれば id 順
+    # どちらも無い場合、SQL 検索では使うインデックスによって順序が変わる（メモリ内検索は常に id 順）
+    engine = engine or get_engine()
+    if engine is not None:
+        with timed('query', ('columnar', filters)):
+            return engine.search(filters, fields, after, limit, sort)
+    columns = ', '.join(fields) if fields else '*'
+    with get_connection() as conn:
+        query, params = build_search_query(conn, filters, columns, after, limit, sort)
+        with timed('query', (query, params)):
+            cursor = conn.execute(query, params)
+            rows = cursor.fetchall()
+        return [desc[0] for desc in cursor.description], rows
+
+
+def iter_restaurants(filters, fields=None, after=None, limit=None, engine=None, sort=None):
+    # search_restaurants と同じ結果を、カーソルから少しずつ読み出すイテレータとして返す
+    engine = engine or get_engine()
+    column_names = list(fields or get_columns())
+    if engine is not None:
+        with timed('query', ('columnar', filters)):
+            _, rows = engine.search(filters, fields, after, limit, sort)
+        return column_names, iter(rows)
+
+    def rows():
+        columns = ', '.join(column_names)
+        # 読み出し中は接続を保持し続けるため、プールの接続を使わない
+        with get_dedicated_connection() as conn:
+            query, params = build_search_query(conn, filters, columns, after, limit, sort)
+            with timed('query', (query, params)):
+                cursor = conn.execute(query, params)
+            while True:
+                chunk = cursor.fetchmany(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield from chunk
+
+    return column_names, rows()
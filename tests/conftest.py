@@ -0,0 +1,43 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+import search  # noqa: E402
+from init_db import create_derived_objects, create_restaurants_table  # noqa: E402
+
+
+def insert_restaurants(conn, records):
+    for record in records:
+        columns = list(record)
+        conn.execute(
+            f"INSERT INTO restaurants ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+            [record[name] for name in columns],
+        )
+
+
+@pytest.fixture
+def make_database(tmp_path, monkeypatch):
+    # 一時ディレクトリにデータベースを作り、アプリの接続先をそこへ向ける
+    path = str(tmp_path / 'test.db')
+    monkeypatch.setattr(db, 'DATABASE_PATH', path)
+    monkeypatch.setattr(search, '_columns', None)
+    monkeypatch.setattr(search, '_search_tables', set())
+    db.close_pools()
+
+    def make(records=(), analyze=False):
+        conn = db.connect(path)
+        create_restaurants_table(conn)
+        insert_restaurants(conn, records)
+        create_derived_objects(conn)
+        if analyze:
+            conn.execute('ANALYZE')
+        conn.commit()
+        conn.close()
+        return path
+
+    yield make
+    db.close_pools()
@@ -0,0 +1,189 @@
+import pytest
+
+import db
+from db import connect
+
+
+@pytest.fixture
+def client(make_database):
+    import app
+
+    make_database([{'id': 1, 'name': 'a', 'category': '居酒屋'}])
+    app.response_cache.clear()
+    return app.app.test_client()
+
+
+@pytest.mark.parametrize('body', [[1, 2], 'ids', 1, None, {'ids': 'x'}, {'ids': [1, 'a']}])
+def test_batch_rejects_malformed_body(client, body):
+    response = client.post('/api/restaurants/batch', json=body)
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'ids には整数の配列を指定してください。'}
+
+
+def test_batch_returns_requested_ids(client):
+    response = client.post('/api/restaurants/batch', json={'ids': [2, 1], 'fields': ['name']})
+    assert response.status_code == 200
+    assert response.get_json() == {'restaurants': [
+        {'id': 2, 'error': 'Restaurant not found'},
+        {'id': 1, 'name': 'a'},
+    ]}
+
+
+@pytest.mark.parametrize('menus', ['false', '0', 0, 1, None, []])
+def test_batch_rejects_non_boolean_menus(client, menus):
+    response = client.post('/api/restaurants/batch', json={'ids': [1], 'menus': menus})
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'menus には true または false を指定してください。'}
+
+
+def test_batch_menus(client):
+    response = client.post('/api/restaurants/batch', json={'ids': [1], 'fields': ['name'], 'menus': True})
+    assert response.get_json() == {'restaurants': [
+        {'id': 1, 'name': 'a', 'menu_details': {'foodMenu': [], 'drinkMenu': []}},
+    ]}
+    response = client.post('/api/restaurants/batch', json={'ids': [1], 'fields': ['name'], 'menus': False})
+    assert response.get_json() == {'restaurants': [{'id': 1, 'name': 'a'}]}
+
+
+@pytest.fixture
+def nearby_client(make_database, monkeypatch):
+    import app
+
+    make_database([
+        {'id': id, 'name': f'店舗{id}', 'description': '説明' * 100,
+         'latitude': 35.69 + id * 0.0001, 'longitude': 139.70}
+        for id in range(1, 21)
+    ])
+    monkeypatch.setattr(app, 'MAX_PAGE_SIZE', 5)
+    app.response_cache.clear()
+    return app.app.test_client()
+
+
+def test_nearby_without_k_is_capped(nearby_client):
+    body = nearby_client.get('/api/restaurants/nearby?lat=35.69&lng=139.70').get_json()
+    assert [item['id'] for item in body['restaurants']] == [1, 2, 3, 4, 5]
+    assert body['truncated'] is True
+
+    body = nearby_client.get('/api/restaurants/nearby?lat=35.69&lng=139.70&radius=50').get_json()
+    assert [item['id'] for item in body['restaurants']] == [1, 2, 3, 4]
+    assert body['truncated'] is False
+
+
+def test_nearby_fields(nearby_client):
+    response = nearby_client.get('/api/restaurants/nearby?lat=35.69&lng=139.70&k=2&fields=name')
+    assert response.get_json() == {'restaurants': [
+        {'id': 1, 'name': '店舗1', 'distance': 11.1},
+        {'id': 2, 'name': '店舗2', 'distance': 22.2},
+    ]}
+    response = nearby_client.get('/api/restaurants/nearby?lat=35.69&lng=139.70&fields=nope')
+    assert response.status_code == 400
+
+
+def _detail(client, **headers):
+    return client.get('/restaurant/1', headers=headers)
+
+
+def test_etag_and_conditional_get(client):
+    import app
+
+    cache = app.response_cache
+    before = cache.stats()
+    first = _detail(client)
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+    assert etag.startswith('"') and not etag.startswith('W/')
+
+    second = _detail(client, **{'If-None-Match': etag})
+    assert second.status_code == 304
+    assert second.data == b''
+    assert second.headers['ETag'] == etag
+    stats = cache.stats()
+    assert (stats['misses'] - before['misses'], stats['hits'] - before['hits']) == (1, 1)
+
+    # データが変わるとキャッシュは破棄され、新しい ETag になる
+    conn = connect(db.DATABASE_PATH)
+    conn.execute("UPDATE restaurants SET name = 'b' WHERE id = 1")
+    conn.commit()
+    conn.close()
+    third = _detail(client, **{'If-None-Match': etag})
+    assert third.status_code == 200
+    assert third.get_json()['name'] == 'b'
+    assert third.headers['ETag'] != etag
+    stats = cache.stats()
+    assert stats['misses'] - before['misses'] == 2
+    assert stats['invalidations'] > before['invalidations']
+
+
+def test_etag_without_cache(client, monkeypatch):
+    import app
+
+    monkeypatch.setattr(app.response_cache, 'maxsize', 0)
+    first = _detail(client)
+    etag = first.headers['ETag']
+    assert _detail(client, **{'If-None-Match': etag}).status_code == 304
+    assert app.response_cache.stats()['size'] == 0
+    assert _detail(client, **{'If-None-Match': '"other"'}).status_code == 200
+
+
+def test_payloads_match_jsonify(make_database):
+    import app
+    from payloads import DETAIL_COLUMNS, build_detail, build_menu
+
+    menu = '[{"name": "唐揚げ", "price": 500}]'
+    path = make_database([{'id': 1, 'name': '居酒屋 "あ"\\', 'category': '居酒屋', 'menu': menu,
+                           'drink_menu': '[]', 'budget_min': 3000}])
+    app.response_cache.clear()
+    conn = connect(path)
+    try:
+        stored = conn.execute('SELECT detail FROM restaurant_payloads WHERE id = 1').fetchone()[0]
+        row = conn.execute(f'SELECT {DETAIL_COLUMNS} FROM restaurants WHERE id = 1').fetchone()
+    finally:
+        conn.close()
+
+    # 事前生成したバイト列は jsonify の出力と一致し、日本語は UTF-8 のまま保存する
+    with app.app.app_context():
+        assert stored == app.jsonify(build_detail(row)).get_data()
+        menu_body = app.jsonify(build_menu(row)).get_data()
+    assert '唐揚げ'.encode() in stored
+
+    client = app.app.test_client()
+    for url, body in (('/restaurant/1', stored), ('/restaurant/1/menu', menu_body)):
+        response = client.get(url)
+        assert response.status_code == 200
+        assert response.content_type == 'application/json; charset=utf-8'
+        assert response.get_data() == body
+
+
+def _rows_returned(client, endpoint):
+    line = f'restaurants_rows_returned_total{{endpoint="{endpoint}"}} '
+    for text in client.get('/metrics').get_data(as_text=True).splitlines():
+        if text.startswith(line):
+            return int(text[len(line):])
+    return 0
+
+
+@pytest.mark.parametrize('cache_size', [256, 0])
+def test_rows_returned_includes_cache_hits(client, monkeypatch, cache_size):
+    import app
+
+    monkeypatch.setattr(app.response_cache, 'maxsize', cache_size)
+    before = _rows_returned(client, '/api/restaurants/batch')
+    hits = app.response_cache.stats()['hits']
+    for _ in range(3):
+        response = client.post('/api/restaurants/batch', json={'ids': [1, 2]})
+        assert response.status_code == 200
+    # 見つかった1件ずつ、キャッシュから返した2回も数える
+    assert _rows_returned(client, '/api/restaurants/batch') == before + 3
+    assert app.response_cache.stats()['hits'] - hits == (2 if cache_size else 0)
+
+
+def test_server_timing_header(client):
+    response = client.post('/api/restaurants/batch', json={'ids': [1]})
+    entries = [entry.split(';') for entry in response.headers['Server-Timing'].split(', ')]
+    assert [phase for phase, _ in entries] == ['parse', 'query', 'serialize', 'total']
+    assert all(duration.startswith('dur=') for _, duration in entries)
+
+    # キャッシュから返した場合はクエリを実行しない
+    response = client.post('/api/restaurants/batch', json={'ids': [1]})
+    phases = [entry.split(';')[0] for entry in response.headers['Server-Timing'].split(', ')]
+    assert phases == ['parse', 'total']
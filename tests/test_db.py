@@ -0,0 +1,47 @@
+import pytest
+
+import db
+from db import ConnectionPool, PoolTimeout
+
+
+def test_acquire_times_out_when_pool_is_exhausted(make_database):
+    pool = ConnectionPool(make_database(), size=1, timeout=0.05)
+    conn = pool.acquire()
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    stats = pool.stats()
+    assert stats['timeouts'] == 1
+    assert stats['in_use'] == 1
+    pool.release(conn)
+    assert pool.acquire() is conn
+    pool.release(conn)
+    pool.close()
+
+
+def test_exhausted_pool_returns_503(make_database):
+    import app
+
+    make_database([{'id': 1, 'name': 'a', 'category': '居酒屋'}])
+    db._pools[True] = ConnectionPool(db.DATABASE_PATH, size=1, timeout=0.05)
+    app.response_cache.clear()
+    client = app.app.test_client()
+    with db.get_connection():
+        response = client.get('/restaurant/1')
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '1'
+    assert client.get('/restaurant/1').status_code == 200
+
+
+def test_streaming_does_not_hold_pooled_connection(make_database):
+    import app
+
+    make_database([{'id': id, 'name': f'店舗{id}', 'category': '居酒屋'} for id in range(1, 2001)])
+    client = app.app.test_client()
+    response = client.post('/results?format=ndjson', json={}, buffered=False)
+    assert response.status_code == 200
+    body = iter(response.response)
+    first = next(body)
+    assert db.pool_stats()['read']['in_use'] == 0
+    lines = (first + b''.join(body)).decode().splitlines()
+    response.close()
+    assert len(lines) == 2000
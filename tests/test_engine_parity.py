@@ -0,0 +1,110 @@
+import random
+
+import pytest
+
+import search
+from search import parse_results_filters, search_restaurants
+
+np = pytest.importorskip('numpy')
+
+from engine import ColumnarEngine  # noqa: E402
+
+AREAS = ['新宿', '渋谷', 'shibuya', 'Shibuya', 'ＳＨＩＢＵＹＡ', '', None]
+CATEGORIES = ['居酒屋', '居酒屋・焼鳥', 'Bar', 'bar', 'BAR・居酒屋', 'ＢＡＲ', 'ｂａｒ', 'café', 'CAFÉ', '', None]
+FLAGS = ['有', '無', '', None]
+GENRES = ['居酒屋', '焼鳥', 'bar', 'BAR', 'ｂａｒ', 'ＢＡＲ', 'café', 'CAFÉ', 'caf', 'AR', '寿司', '%', 'b_r']
+# 数値列に入り得る値（NULL・文字列・数値文字列を含む）
+NUMBERS = [None, 'not a number', '3000', '', 0, 4, 20, 1000, 2500, 3000, 4500, 8000, 2.5]
+TARGETS = ['4', '20', '3000', '2500.5', 'abc', 0, 4, 3000, '１０']
+
+
+def _value(rng, choices, numeric=None):
+    return rng.randrange(*numeric) if numeric and rng.random() < 0.7 else rng.choice(choices)
+
+
+def _records(count):
+    rng = random.Random(0)
+    return [{
+        'id': id,
+        'name': f'店舗{id}',
+        'area': rng.choice(AREAS),
+        'category': rng.choice(CATEGORIES),
+        'capacity': _value(rng, NUMBERS, (2, 100)),
+        'budget_min': _value(rng, NUMBERS, (1000, 6000, 500)),
+        'budget_max': _value(rng, NUMBERS, (2000, 10000, 500)),
+        'has_private_room': rng.choice(FLAGS),
+        'has_drink_all_included': rng.choice(FLAGS),
+        'tabelog_rating': _value(rng, NUMBERS, (30, 45)),
+        'tabelog_reviews': _value(rng, NUMBERS, (0, 500)),
+        'google_rating': _value(rng, NUMBERS, (25, 50)),
+        'google_reviews': _value(rng, NUMBERS, (0, 500)),
+    } for id in rng.sample(range(1, 2000), 400)]
+
+
+def _filters(rng):
+    payload = {}
+    if rng.random() < 0.4:
+        payload['area'] = rng.choice(AREAS[:-2])
+    if rng.random() < 0.4:
+        payload['genre'] = rng.choice(GENRES)
+    if rng.random() < 0.3:
+        payload['guests'] = rng.choice(TARGETS)
+    if rng.random() < 0.3:
+        payload['budgetMin'] = rng.choice(TARGETS)
+    if rng.random() < 0.3:
+        payload['budgetMax'] = rng.choice(TARGETS)
+    if rng.random() < 0.2:
+        payload['privateRoom'] = rng.choice(FLAGS[:2])
+    if rng.random() < 0.2:
+        payload['drinkIncluded'] = rng.choice(FLAGS[:2])
+    return parse_results_filters(payload)
+
+
+def test_columnar_engine_matches_sql(make_database, monkeypatch):
+    monkeypatch.setattr(search, 'SEARCH_ENGINE', 'sql')
+    monkeypatch.setattr(search, '_engine', None)
+    make_database(_records(400))
+    engine = ColumnarEngine()
+    rng = random.Random(1)
+    for _ in range(300):
+        filters = _filters(rng)
+        sort = rng.choice([None, None, *search.SORT_ORDERS])
+        after = rng.choice([None, rng.randrange(2000)]) if sort is None else None
+        limit = rng.choice([None, 1, 7, 50])
+        fields = rng.choice([None, ['id'], ['id', 'area', 'capacity']])
+        column_names, expected = search_restaurants(filters, fields, after, limit, sort=sort)
+        if sort is None and after is None and limit is None:
+            # 並び順の指定が無い SQL 検索の結果は順序が決まらないため id 順にそろえて比べる
+            expected = sorted(expected)
+        assert engine.search(filters, fields, after, limit, sort) == (column_names, expected), (
+            filters, sort, after, limit, fields,
+        )
+
+
+def test_reloads_only_when_restaurants_change(make_database):
+    from db import connect
+    from engine import ENGINE_COLUMNS
+    from load_data import upsert_records
+
+    path = make_database(_records(400))
+    engine = ColumnarEngine()
+    filters = parse_results_filters({})
+    column_names, rows = engine.search(filters, limit=3)
+    assert len(column_names) > len(ENGINE_COLUMNS) and len(rows[0]) == len(column_names)
+    assert engine._loaded[1].column_names == list(ENGINE_COLUMNS)
+    assert engine.rebuilds == 1
+
+    conn = connect(path)
+    try:
+        # restaurants 以外のテーブルだけのコミットでは読み直さない
+        conn.execute('DELETE FROM restaurant_payloads')
+        conn.commit()
+        engine.search(filters, limit=3)
+        assert engine.rebuilds == 1
+
+        upsert_records(conn, [{'id': rows[0][0], '_delete': '1'}, {'id': 5000, 'name': '追加'}])
+        _, ids = engine.search(filters, ['id'])
+        assert engine.rebuilds == 2
+        assert rows[0][0] not in {id for id, in ids} and (5000,) in ids
+    finally:
+        conn.close()
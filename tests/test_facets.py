@@ -0,0 +1,130 @@
+import random
+
+from db import connect
+from facets import GENRE_SEPARATORS, FacetIndex, budget_buckets
+from init_db import create_derived_objects
+from load_data import upsert_records
+from search import parse_results_filters, search_restaurants
+
+AREAS = ['新宿', '渋谷', 'shibuya', 'Shibuya', None]
+CATEGORIES = ['居酒屋', '居酒屋・焼鳥', 'Bar', 'bar・居酒屋', '寿司', None]
+FLAGS = ['有', '無', None]
+BUDGETS = [None, 'ask', 900, 1000, 2500, 3000, 5500, 9000, 12000]
+COLUMNS = ['id', 'area', 'category', 'budget_min', 'has_private_room', 'has_drink_all_included']
+
+
+def _record(rng, id):
+    budget_min = rng.choice(BUDGETS)
+    return {
+        'id': id,
+        'name': f'店舗{id}',
+        'area': rng.choice(AREAS),
+        'category': rng.choice(CATEGORIES),
+        'capacity': rng.choice([None, 4, 20, 60]),
+        'budget_min': budget_min,
+        'budget_max': budget_min + 2000 if isinstance(budget_min, int) else rng.choice(BUDGETS),
+        'has_private_room': rng.choice(FLAGS),
+        'has_drink_all_included': rng.choice(FLAGS),
+    }
+
+
+def _filters(rng):
+    payload = {}
+    if rng.random() < 0.3:
+        payload['area'] = rng.choice(AREAS[:-1])
+    if rng.random() < 0.3:
+        payload['genre'] = rng.choice(['居酒屋', 'bar', 'BAR', '焼', 'なし'])
+    if rng.random() < 0.3:
+        payload['guests'] = rng.choice(['10', '50'])
+    if rng.random() < 0.3:
+        payload['budgetMin'] = rng.choice(['1000', '3000', 'ask'])
+    if rng.random() < 0.3:
+        payload['budgetMax'] = rng.choice(['5000', '11000'])
+    if rng.random() < 0.3:
+        payload['privateRoom'] = rng.choice(FLAGS[:-1])
+    if rng.random() < 0.3:
+        payload['drinkIncluded'] = rng.choice(FLAGS[:-1])
+    return parse_results_filters(payload)
+
+
+def _without(filters, *names):
+    return {**filters, **{name: None for name in names}}
+
+
+def _rows(filters):
+    return search_restaurants(filters, COLUMNS)[1]
+
+
+def _group(rows, position):
+    counts = {}
+    for row in rows:
+        if row[position] is not None:
+            counts[str(row[position])] = counts.get(str(row[position]), 0) + 1
+    return counts
+
+
+def _expected(filters):
+    # search_restaurants の結果から各ファセットの件数を数える
+    everything = _rows({})
+    values = {name: {str(row[i]) for row in everything if row[i] is not None} for i, name in enumerate(COLUMNS)}
+    genres = {
+        genre for category in values['category']
+        for genre in GENRE_SEPARATORS.split(category) if genre
+    }
+    budget_rows = _rows(_without(filters, 'budget_min', 'budget_max'))
+    return {
+        'total': len(_rows(filters)),
+        'facets': {
+            'area': {**dict.fromkeys(values['area'], 0), **_group(_rows(_without(filters, 'area')), 1)},
+            'genre': {genre: len(_rows({**filters, 'genre': genre})) for genre in genres},
+            'budget': [
+                {'label': label, 'min': low, 'max': high, 'count': sum(
+                    1 for row in budget_rows
+                    if isinstance(row[3], int) and (low is None or row[3] >= low) and (high is None or row[3] < high)
+                )}
+                for label, low, high in budget_buckets()
+            ],
+            'privateRoom': {
+                **dict.fromkeys(values['has_private_room'], 0),
+                **_group(_rows(_without(filters, 'private_room')), 4),
+            },
+            'drinkIncluded': {
+                **dict.fromkeys(values['has_drink_all_included'], 0),
+                **_group(_rows(_without(filters, 'drink_included')), 5),
+            },
+        },
+    }
+
+
+def _check(index, rng):
+    for _ in range(40):
+        filters = _filters(rng)
+        assert index.counts(filters) == _expected(filters), filters
+
+
+def test_counts_match_sql_across_incremental_updates_and_rebuilds(make_database):
+    rng = random.Random(0)
+    path = make_database([_record(rng, id) for id in range(1, 301)])
+    index = FacetIndex()
+    _check(index, rng)
+    assert (index.rebuilds, index.updates) == (1, 0)
+
+    # 更新・削除・追加を差分で反映する
+    conn = connect(path)
+    try:
+        changes = [_record(rng, id) for id in rng.sample(range(1, 301), 60)]
+        changes += [{'id': id, '_delete': '1'} for id in rng.sample(range(1, 301), 40)]
+        changes += [_record(rng, id) for id in range(301, 341)]
+        upsert_records(conn, changes)
+        _check(index, rng)
+        assert (index.rebuilds, index.updates) == (1, 1)
+        assert index.stats()['rows'] == conn.execute('SELECT COUNT(*) FROM restaurants').fetchone()[0]
+
+        # 検索用オブジェクトを作り直すと履歴に NULL の印が入り、全件読み直しになる
+        conn.execute("UPDATE restaurants SET area = '池袋' WHERE id <= 20")
+        create_derived_objects(conn)
+        conn.commit()
+        _check(index, rng)
+        assert index.rebuilds == 2
+    finally:
+        conn.close()
@@ -0,0 +1,69 @@
+import math
+import random
+
+import pytest
+
+from geo import EARTH_RADIUS_M, haversine, nearby_restaurants
+from search import parse_results_filters
+
+CENTER = (35.6909, 139.7003)
+
+
+def _records(count):
+    rng = random.Random(0)
+    records = []
+    for id in range(1, count + 1):
+        # 中心付近に密集させ、一部は遠くに散らばらせる
+        spread = 0.002 if id % 3 else 0.05
+        records.append({
+            'id': id,
+            'name': f'店舗{id}',
+            'category': rng.choice(('居酒屋', '焼肉', 'Bar')),
+            'latitude': CENTER[0] + rng.uniform(-spread, spread),
+            'longitude': CENTER[1] + rng.uniform(-spread, spread),
+        })
+    records.append({'id': count + 1, 'name': '座標なし', 'category': '居酒屋'})
+    return records
+
+
+def _expected(records, filters, lat, lng, radius, k):
+    matched = [
+        (haversine(lat, lng, record['latitude'], record['longitude']), record['id'])
+        for record in records
+        if 'latitude' in record and (not filters or filters['genre'] in record['category'])
+    ]
+    limit = radius or (1000 if k is None else 50000)
+    matched = sorted(item for item in matched if item[0] <= limit)
+    return [id for _, id in matched[:k]]
+
+
+@pytest.mark.parametrize('filters', [{}, {'genre': '居酒屋'}])
+@pytest.mark.parametrize('radius, k', [
+    (None, 1), (None, 5), (None, 50), (None, 1000), (300, 10), (300, None), (None, None), (5000, None),
+])
+def test_nearby_matches_brute_force(make_database, filters, radius, k):
+    records = _records(1000)
+    make_database(records)
+    rng = random.Random(1)
+    for _ in range(5):
+        lat = CENTER[0] + rng.uniform(-0.01, 0.01)
+        lng = CENTER[1] + rng.uniform(-0.01, 0.01)
+        column_names, results = nearby_restaurants(parse_results_filters(filters), lat, lng, radius, k)
+        assert [row[0] for _, row in results] == _expected(records, filters, lat, lng, radius, k)
+        distances = [distance for distance, _ in results]
+        assert distances == sorted(distances)
+
+
+def test_nearby_includes_rows_near_the_edge(make_database):
+    # 半径のすぐ内側（真北・真東）の店舗も矩形の絞り込みで落とさない
+    lat, lng = CENTER
+    north = lat + math.degrees(2998 / EARTH_RADIUS_M)
+    east = lng + math.degrees(2998 / EARTH_RADIUS_M) / math.cos(math.radians(lat))
+    make_database([
+        {'id': 1, 'name': '北', 'latitude': north, 'longitude': lng},
+        {'id': 2, 'name': '東', 'latitude': lat, 'longitude': east},
+    ])
+    _, results = nearby_restaurants({}, lat, lng, 3000)
+    assert sorted(row[0] for _, row in results) == [1, 2]
+    _, results = nearby_restaurants({}, lat, lng, 3000, k=2)
+    assert len(results) == 2
@@ -0,0 +1,31 @@
+from db import connect
+from init_db import create_restaurants_table, init_db, main
+
+
+def test_migrate_keeps_rows_in_given_database(tmp_path):
+    path = str(tmp_path / 'other.db')
+    conn = connect(path)
+    create_restaurants_table(conn)
+    conn.execute("INSERT INTO restaurants (id, name, category) VALUES (1, 'a', '居酒屋')")
+    conn.commit()
+    conn.close()
+
+    main(['--migrate', '--database', path])
+    conn = connect(path)
+    try:
+        assert conn.execute('SELECT id, name FROM restaurants').fetchall() == [(1, 'a')]
+        assert conn.execute(
+            "SELECT rowid FROM restaurants_fts WHERE restaurants_fts MATCH '居酒屋'"
+        ).fetchall() == [(1,)]
+    finally:
+        conn.close()
+
+
+def test_init_db_creates_empty_database_at_path(tmp_path):
+    path = str(tmp_path / 'new.db')
+    init_db(path)
+    conn = connect(path)
+    try:
+        assert conn.execute('SELECT COUNT(*) FROM restaurants').fetchone()[0] == 0
+    finally:
+        conn.close()
@@ -0,0 +1,118 @@
+import pytest
+
+from db import connect
+from load_data import DELETE_FIELD, SHADOW_TABLE, _is_deleted, read_records, replace_records, upsert_records
+
+
+def test_upsert_existing_row_with_known_category(make_database):
+    path = make_database([
+        {'id': 1, 'name': 'a', 'category': '居酒屋'},
+        {'id': 2, 'name': 'b', 'category': '焼肉'},
+    ])
+    conn = connect(path)
+    try:
+        writer = upsert_records(conn, [
+            {'id': 1, 'name': 'a2', 'category': '居酒屋'},
+            {'id': 2, 'name': 'b2', 'category': '居酒屋'},
+            {'id': 3, 'name': 'c', 'category': '寿司'},
+        ])
+        assert writer.written == 3
+        rows = conn.execute('SELECT id, name, category FROM restaurants ORDER BY id').fetchall()
+        assert rows == [(1, 'a2', '居酒屋'), (2, 'b2', '居酒屋'), (3, 'c', '寿司')]
+        categories = {row[0] for row in conn.execute('SELECT category FROM restaurant_categories')}
+        assert categories == {'居酒屋', '焼肉', '寿司'}
+    finally:
+        conn.close()
+
+
+def test_upsert_delete(make_database):
+    path = make_database([{'id': 1, 'name': 'a', 'category': '居酒屋'}])
+    conn = connect(path)
+    try:
+        writer = upsert_records(conn, [{'id': 1, '_delete': '1'}])
+        assert writer.deleted == 1
+        assert conn.execute('SELECT COUNT(*) FROM restaurants').fetchone()[0] == 0
+    finally:
+        conn.close()
+
+
+def test_csv_delete_flag_is_parsed_strictly(make_database, tmp_path):
+    path = make_database([{'id': id, 'name': f'店舗{id}'} for id in range(1, 9)])
+    csv_path = tmp_path / 'input.csv'
+    csv_path.write_text(
+        'id,name,_delete\n'
+        '1,a,False\n2,b,FALSE\n3,c,no\n4,d,0\n5,e,\n'
+        '6,,1\n7,,TRUE\n8,,Yes\n',
+        encoding='utf-8',
+    )
+    conn = connect(path)
+    try:
+        writer = upsert_records(conn, read_records(str(csv_path)))
+        assert (writer.written, writer.deleted) == (5, 3)
+        rows = conn.execute('SELECT id, name FROM restaurants ORDER BY id').fetchall()
+        assert rows == [(1, 'a'), (2, 'b'), (3, 'c'), (4, 'd'), (5, 'e')]
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize('value', ['maybe', 'f', '2', 2, 0.0, []])
+def test_invalid_delete_flag_raises(value):
+    with pytest.raises(ValueError):
+        _is_deleted({'id': 1, DELETE_FIELD: value})
+
+
+def test_upsert_by_key_requires_unique_index(make_database):
+    path = make_database([{'id': 1, 'name': 'a'}, {'id': 2, 'name': 'b'}])
+    conn = connect(path)
+    try:
+        with pytest.raises(ValueError):
+            upsert_records(conn, [{'name': 'a', 'area': '新宿'}], key='name')
+        # インデックスは作らないので、同じ名前の店舗を追加できる
+        indexes = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'index' AND sql LIKE '%(name)%'")
+        assert indexes.fetchall() == []
+        upsert_records(conn, [{'id': 3, 'name': 'a'}])
+
+        conn.execute('CREATE UNIQUE INDEX idx_restaurants_phone ON restaurants(phone)')
+        conn.execute("UPDATE restaurants SET phone = '03-' || id")
+        conn.commit()
+        writer = upsert_records(conn, [{'phone': '03-1', 'name': 'a2'}, {'phone': '03-9', 'id': 9, 'name': 'i'}],
+                                key='phone')
+        assert writer.written == 2
+        rows = conn.execute('SELECT id, name FROM restaurants ORDER BY id').fetchall()
+        assert rows == [(1, 'a2'), (2, 'b'), (3, 'a'), (9, 'i')]
+    finally:
+        conn.close()
+
+
+def test_replace_records_rebuilds_derived_objects(make_database):
+    path = make_database([
+        {'id': id, 'name': f'旧{id}', 'category': '焼肉', 'latitude': 35.0, 'longitude': 139.0}
+        for id in range(1, 6)
+    ])
+    conn = connect(path)
+    try:
+        writer = replace_records(conn, [
+            {'id': 10, 'name': 'a', 'category': '居酒屋', 'latitude': 35.69, 'longitude': 139.70},
+            {'id': 11, 'name': 'b', 'category': '居酒屋・焼鳥'},
+            {'id': 12, 'name': 'c', 'category': '寿司', 'latitude': 35.70, 'longitude': 139.71},
+        ], batch_size=2)
+        assert writer.written == 3
+        assert conn.execute('SELECT id FROM restaurants ORDER BY id').fetchall() == [(10,), (11,), (12,)]
+        assert conn.execute('SELECT 1 FROM sqlite_master WHERE name = ?', (SHADOW_TABLE,)).fetchone() is None
+
+        fts = conn.execute(
+            "SELECT rowid FROM restaurants_fts WHERE restaurants_fts MATCH '居酒屋' ORDER BY rowid"
+        ).fetchall()
+        assert fts == [(10,), (11,)]
+        assert conn.execute('SELECT id FROM restaurants_rtree ORDER BY id').fetchall() == [(10,), (12,)]
+        assert conn.execute('SELECT id FROM restaurant_payloads ORDER BY id').fetchall() == [(10,), (11,), (12,)]
+        assert conn.execute("PRAGMA integrity_check").fetchone()[0] == 'ok'
+
+        # 入れ替え後のテーブルにも差分ロード用のトリガーが付いている
+        upsert_records(conn, [{'id': 12, 'name': 'c2', 'category': '居酒屋'}])
+        fts = conn.execute(
+            "SELECT rowid FROM restaurants_fts WHERE restaurants_fts MATCH '居酒屋' ORDER BY rowid"
+        ).fetchall()
+        assert fts == [(10,), (11,), (12,)]
+    finally:
+        conn.close()
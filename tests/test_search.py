@@ -0,0 +1,25 @@
+import pytest
+
+from search import parse_results_filters, search_restaurants
+
+CATEGORIES = ['Bar', 'BAR・居酒屋', 'ＢＡＲ', 'ｂａｒ', 'café', 'CAFÉ', 'Café']
+
+
+@pytest.mark.parametrize('genre, expected', [
+    # ASCII は大文字小文字を区別せず、それ以外は区別する（LIKE と同じ）
+    ('bar', ['Bar', 'BAR・居酒屋']),
+    ('ｂａｒ', ['ｂａｒ']),
+    ('ＢＡＲ', ['ＢＡＲ']),
+    ('café', ['café', 'Café']),
+    ('CAFÉ', ['CAFÉ']),
+    ('CAF', ['café', 'CAFÉ', 'Café']),
+])
+def test_genre_case_folding_matches_like(make_database, genre, expected):
+    make_database([
+        {'id': id, 'name': f'店舗{id}', 'category': category}
+        for id, category in enumerate(CATEGORIES, 1)
+    ])
+    filters = parse_results_filters({'genre': genre})
+    for sort in (None, 'score'):
+        column_names, rows = search_restaurants(filters, ['id', 'category'], sort=sort)
+        assert sorted(row[1] for row in rows) == sorted(expected)
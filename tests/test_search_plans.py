@@ -0,0 +1,68 @@
+import random
+
+import pytest
+
+from db import connect
+from search import SORT_ORDERS, explain_search, parse_results_filters
+
+GENRES = ['居酒屋', '焼肉', '寿司', 'イタリアン', '中華', 'もつ鍋', 'Bar', 'ダイニングバー']
+
+
+def _records(count):
+    # 各条件が全体のごく一部だけに一致するデータ（インデックスを使うべき状況）
+    rng = random.Random(0)
+    records = []
+    for id in range(1, count + 1):
+        budget_min = rng.randrange(1000, 20000, 100)
+        records.append({
+            'id': id,
+            'name': f'店舗{id}',
+            'area': f'エリア{rng.randrange(50)}',
+            'category': '・'.join(rng.sample(GENRES, rng.choice((1, 1, 2)))),
+            'capacity': rng.randrange(2, 200),
+            'budget_min': budget_min,
+            'budget_max': budget_min + rng.randrange(500, 5000, 100),
+            'has_private_room': '有' if rng.random() < 0.05 else '無',
+            'has_drink_all_included': '有' if rng.random() < 0.1 else '無',
+            'tabelog_rating': rng.randrange(300, 450) / 100,
+            'tabelog_reviews': rng.randrange(500),
+            'google_rating': rng.randrange(250, 500) / 100,
+            'google_reviews': rng.randrange(500),
+        })
+    return records
+
+
+@pytest.mark.parametrize('filters', [
+    {'area': 'エリア1'},
+    {'area': 'エリア1', 'guests': '150'},
+    {'budgetMin': '3000', 'budgetMax': '4000'},
+    {'privateRoom': '有', 'drinkIncluded': '有'},
+    {'genre': '焼肉'},
+    {'genre': '居酒屋'},
+], ids=['area', 'area_guests', 'budget', 'flags', 'short_genre', 'long_genre'])
+def test_filters_use_index(make_database, filters):
+    conn = connect(make_database(_records(5000), analyze=True))
+    try:
+        plan = explain_search(conn, parse_results_filters(filters))
+    finally:
+        conn.close()
+    assert any(
+        detail.startswith('SEARCH restaurants USING') or 'restaurants_fts VIRTUAL TABLE' in detail
+        for detail in plan
+    ), plan
+    assert not any(detail.startswith('SCAN restaurants') and 'restaurants_fts' not in detail
+                   for detail in plan), plan
+
+
+@pytest.mark.parametrize('sort', list(SORT_ORDERS))
+@pytest.mark.parametrize('filters', [{}, {'area': 'エリア1'}], ids=['all', 'area'])
+def test_ranked_search_reads_index_in_order(make_database, filters, sort):
+    # 並び替えは索引の順に読み、一時 B-tree での並べ替えをしない
+    conn = connect(make_database(_records(5000), analyze=True))
+    try:
+        plan = explain_search(conn, parse_results_filters(filters), limit=20, sort=sort)
+    finally:
+        conn.close()
+    assert not any('TEMP B-TREE' in detail for detail in plan), plan
+    if filters:
+        assert any(detail.startswith('SEARCH restaurants USING') for detail in plan), plan